@@ -44,15 +44,46 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primero, para que el total incluya al resto de la cadena
+    'stock.middleware.RequestTimingMiddleware',
+    'stock.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Necesita request.user
+    'stock.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Medición por petición (consultas, tiempo en SQL, plantillas y vista) en
+# la cabecera Server-Timing y en un log rotativo de líneas JSON.
+# Desactivada por defecto; activarla con DJANGO_REQUEST_TIMING=True.
+REQUEST_TIMING = os.environ.get('DJANGO_REQUEST_TIMING', '') == 'True'
+REQUEST_TIMING_LOG = os.environ.get(
+    'DJANGO_REQUEST_TIMING_LOG', str(BASE_DIR / 'logs' / 'requests.log'))
+# Consultas más lentas que se guardan por petición
+REQUEST_TIMING_SLOW_QUERIES = 3
+
+# Perfil de cProfile a pedido: un usuario staff agrega ?profile=1 (o la
+# cabecera X-Profile: 1) y la petición se guarda en PROFILE_DIR como .prof
+# y pilas colapsadas; se revisan en /perfiles/. Se conservan las últimas
+# PROFILE_KEEP capturas. Se desactiva con DJANGO_REQUEST_PROFILING=False.
+REQUEST_PROFILING = os.environ.get('DJANGO_REQUEST_PROFILING', 'True') == 'True'
+PROFILE_DIR = os.environ.get('DJANGO_PROFILE_DIR', str(BASE_DIR / 'profiles'))
+PROFILE_KEEP = 50
+
+# Métricas en formato Prometheus en /metrics (solo desde la misma máquina):
+# latencia por vista, tiempo en SQL, peticiones por estado, líneas de
+# factura por segundo y antigüedad del dashboard en caché. Los procesos
+# comparten los contadores en el archivo SQLite METRICS_DB.
+# Desactivadas por defecto; activarlas con DJANGO_METRICS=True.
+METRICS = os.environ.get('DJANGO_METRICS', '') == 'True'
+METRICS_DB = os.environ.get('DJANGO_METRICS_DB', str(BASE_DIR / 'metrics.sqlite3'))
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
 ROOT_URLCONF = 'mistock.urls'
 
 TEMPLATES = [
@@ -75,13 +106,94 @@ WSGI_APPLICATION = 'mistock.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+#
+# DJANGO_DB_ENGINE elige el perfil:
+#   sqlite (por defecto): archivo local en modo WAL, ajustado para varios
+#     cajeros a la vez. DJANGO_DB_PATH cambia la ubicación del archivo.
+#   postgresql: DJANGO_DB_NAME, DJANGO_DB_USER, DJANGO_DB_PASSWORD,
+#     DJANGO_DB_HOST y DJANGO_DB_PORT. Requiere psycopg; con
+#     DJANGO_DB_POOL=True usa el pool de psycopg (psycopg[pool]).
+# En ambos, DJANGO_DB_CONN_MAX_AGE (segundos) reutiliza la conexión entre
+# peticiones en vez de abrir una nueva cada vez.
+DB_ENGINE = os.environ.get('DJANGO_DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', '60'))
+
+# Se ejecutan al abrir cada conexión SQLite. WAL deja leer mientras otro
+# escribe; synchronous=NORMAL es seguro en WAL y evita un fsync por
+# transacción; mmap y caché reducen lecturas del archivo.
+SQLITE_PRAGMAS = ";".join([
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=%d" % int(os.environ.get('DJANGO_SQLITE_MMAP_SIZE', 256 * 1024 ** 2)),
+    "PRAGMA cache_size=-%d" % int(os.environ.get('DJANGO_SQLITE_CACHE_KB', 32 * 1024)),
+    "PRAGMA temp_store=MEMORY",
+])
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DJANGO_DB_NAME', 'mistock'),
+            'USER': os.environ.get('DJANGO_DB_USER', ''),
+            'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DJANGO_DB_HOST', ''),
+            'PORT': os.environ.get('DJANGO_DB_PORT', ''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('DJANGO_DB_POOL', '') == 'True':
+        # El pool reemplaza a las conexiones persistentes: Django exige
+        # CONN_MAX_AGE = 0 cuando está activo
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DJANGO_DB_POOL_MIN', '2')),
+            'max_size': int(os.environ.get('DJANGO_DB_POOL_MAX', '10')),
+            'timeout': int(os.environ.get('DJANGO_DB_TIMEOUT', '20')),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DJANGO_DB_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                # Tomar el bloqueo de escritura al iniciar la transacción:
+                # con DEFERRED dos escritores pueden chocar a mitad de la
+                # transacción y SQLite responde "database is locked" sin esperar
+                'transaction_mode': 'IMMEDIATE',
+                # Segundos que una conexión espera el bloqueo antes de fallar
+                'timeout': int(os.environ.get('DJANGO_DB_TIMEOUT', '20')),
+                'init_command': SQLITE_PRAGMAS,
+            },
+            # Base de pruebas en archivo: las pruebas de concurrencia abren
+            # varias conexiones que deben ver los mismos datos
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+
+# Caché (dashboard y reportes)
+# Por defecto en memoria local del proceso. Con varios procesos de trabajo
+# (gunicorn, etc.) definir DJANGO_CACHE_DIR para compartir la caché en disco
+# y que la invalidación llegue a todos los procesos.
+CACHE_DIR = os.environ.get('DJANGO_CACHE_DIR', '')
+
+if CACHE_DIR:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_DIR,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'mistock',
+        }
     }
-}
 
 
 # Password validation
@@ -34,7 +34,8 @@ class PurchaseInline(admin.TabularInline):
 
 @admin.register(PurchaseInvoice)
 class PurchaseInvoiceAdmin(admin.ModelAdmin):
-    list_display = ("date", "supplier", "created_at")
+    list_display = ("date", "supplier", "item_count", "total", "created_at")
+    readonly_fields = ("total", "item_count", "items_summary")
     list_filter = ("date", "supplier")
     date_hierarchy = "date"
     ordering = ("-date",)
@@ -56,7 +57,8 @@ class SaleInline(admin.TabularInline):
 
 @admin.register(SaleInvoice)
 class SaleInvoiceAdmin(admin.ModelAdmin):
-    list_display = ("date", "customer", "created_at")
+    list_display = ("date", "customer", "item_count", "total", "created_at")
+    readonly_fields = ("total", "item_count", "items_summary")
     list_filter = ("date", "customer")
     date_hierarchy = "date"
     ordering = ("-date",)
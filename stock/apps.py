@@ -1,6 +1,21 @@
+import django
 from django.apps import AppConfig
+from django.db import connections
 
 
 class StockConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stock'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+
+def setup_worker(database_name):
+    """
+    Inicializa Django en un proceso hijo (pool de rebuild_inventory) con la
+    misma base que el proceso principal, que en las pruebas es la de prueba.
+    Vive aquí porque el hijo lo importa antes de cargar los modelos.
+    """
+    django.setup()
+    connections["default"].settings_dict["NAME"] = database_name
@@ -0,0 +1,499 @@
+import gzip
+import io
+import json
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .rollups import refresh_invoice_totals
+
+BACKUP_VERSION = "1.2"
+
+# Orden de exportación/importación (respeta dependencias entre modelos)
+BACKUP_MODELS = [
+    "Category", "ExpenseCategory", "Product", "ProductImage",
+    "PurchaseInvoice", "Purchase", "SaleInvoice", "Sale", "Expense",
+    "OtherIncomeCategory", "OtherIncome",
+]
+
+# Tamaño aproximado de cada bloque enviado al cliente / leído del archivo
+STREAM_BUFFER_SIZE = 64 * 1024
+
+# Filas por operación bulk al restaurar
+IMPORT_BATCH_SIZE = 500
+
+# Margen mínimo (segundos) entre el checkpoint y el inicio de la exportación
+CHECKPOINT_MARGIN = 30
+
+# Modelo de línea → modelo de factura cuyos totales guardados dependen de ella
+LINE_INVOICES = {"Purchase": "PurchaseInvoice", "Sale": "SaleInvoice"}
+
+
+def dump(value):
+    return json.dumps(value, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def parse_checkpoint(value):
+    """Convierte un checkpoint ISO 8601 en datetime con zona horaria."""
+    checkpoint = parse_datetime(value) if value else None
+    if checkpoint is None:
+        raise ValueError(f"Checkpoint inválido: {value!r}")
+    if timezone.is_naive(checkpoint):
+        checkpoint = timezone.make_aware(checkpoint)
+    return checkpoint
+
+
+def export_checkpoint():
+    """
+    Checkpoint de una exportación que empieza ahora: la hora actual menos
+    un margen de al menos la espera por el lock de la base
+    (DJANGO_DB_TIMEOUT). Una transacción que escribió antes de ese momento
+    ya confirmó o falló, así que el siguiente incremental no pierde filas
+    que aún no se veían al exportar; las que se repiten se reescriben igual
+    al importar, porque la restauración actualiza por pk.
+    """
+    timeout = settings.DATABASES["default"].get("OPTIONS", {}).get("timeout", 0)
+    return timezone.now() - timedelta(seconds=max(CHECKPOINT_MARGIN, timeout))
+
+
+def iter_records(model, chunk_size, since=None, until=None):
+    """
+    Registros serializados de un modelo, leyendo `chunk_size` filas a la vez.
+    Con `since` solo se incluyen las filas creadas o modificadas después y,
+    con `until`, hasta ese momento inclusive.
+    """
+    queryset = model.objects.order_by("pk")
+    if since is not None:
+        queryset = queryset.filter(updated_at__gt=since)
+    if until is not None:
+        queryset = queryset.filter(updated_at__lte=until)
+    serializer = serializers.get_serializer("python")()
+    batch = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        batch.append(obj)
+        if len(batch) >= chunk_size:
+            yield from serializer.serialize(batch)
+            batch = []
+    if batch:
+        yield from serializer.serialize(batch)
+
+
+def iter_backup_json(model_names=BACKUP_MODELS, chunk_size=2000, since=None,
+                     checkpoint=None):
+    """
+    Genera el respaldo JSON ({"metadata": ..., "data": {...}}) por partes,
+    con un registro por línea, sin cargar la base de datos en memoria.
+
+    Con `since` genera un respaldo incremental: solo las filas modificadas
+    y, en "deleted", los ids eliminados entre `since` y `checkpoint`.
+    El "checkpoint" de la metadata (por defecto `export_checkpoint()`) es
+    el `since` del siguiente incremental. Un respaldo completo incluye
+    también lo posterior al checkpoint, que el siguiente incremental vuelve
+    a enviar.
+    """
+    from .models import DeletedRecord
+
+    checkpoint = checkpoint or export_checkpoint()
+    until = checkpoint if since is not None else None
+    metadata = {
+        "export_date": datetime.now().isoformat(),
+        "version": BACKUP_VERSION,
+        "model_count": len(model_names),
+        "type": "delta" if since is not None else "full",
+        "since": since.isoformat() if since is not None else None,
+        "checkpoint": checkpoint.isoformat(),
+    }
+    yield '{\n  "metadata": ' + dump(metadata) + ',\n  "data": {'
+
+    for index, model_name in enumerate(model_names):
+        model = apps.get_model("stock", model_name)
+        yield ("," if index else "") + "\n    " + dump(model_name) + ": ["
+        first = True
+        for record in iter_records(model, chunk_size, since, until):
+            yield ("\n      " if first else ",\n      ") + dump(record)
+            first = False
+        yield "]" if first else "\n    ]"
+
+    yield "\n  }"
+
+    if since is not None:
+        yield ',\n  "deleted": {'
+        for index, model_name in enumerate(model_names):
+            ids = (
+                DeletedRecord.objects
+                .filter(model_name=model_name, deleted_at__gt=since,
+                        deleted_at__lte=checkpoint)
+                .order_by("object_id")
+                .values_list("object_id", flat=True)
+                .distinct()
+            )
+            yield ("," if index else "") + "\n    " + dump(model_name) + ": ["
+            first = True
+            for object_id in ids.iterator(chunk_size=chunk_size):
+                yield ("" if first else ", ") + str(object_id)
+                first = False
+            yield "]"
+        yield "\n  }"
+
+    yield "\n}\n"
+
+
+def buffered(chunks, size=STREAM_BUFFER_SIZE):
+    """Agrupa fragmentos pequeños en bloques de bytes de ~`size`."""
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b"".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def gzipped(blocks, level=6):
+    """Comprime al vuelo una secuencia de bloques de bytes en formato gzip."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class BackupReader:
+    """
+    Lector incremental de respaldos JSON. Recorre el archivo por bloques y
+    decodifica un registro a la vez, sin cargar el archivo completo.
+    Acepta tanto el formato de una línea por registro como el indentado.
+    """
+
+    def __init__(self, stream, read_size=STREAM_BUFFER_SIZE):
+        self.stream = stream
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        data = self.stream.read(self.read_size)
+        if not data:
+            self.eof = True
+            return
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+
+    def peek(self):
+        """Siguiente carácter que no sea espacio (sin consumirlo)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise json.JSONDecodeError("Fin de archivo inesperado",
+                                           self.buffer, self.pos)
+            self.fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Se esperaba '{char}'",
+                                       self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """Decodifica el siguiente valor JSON completo."""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.fill()
+                continue
+            if end == len(self.buffer) and not self.eof \
+                    and not isinstance(obj, (dict, list)):
+                # Un número o literal podría continuar en el siguiente bloque
+                self.fill()
+                continue
+            self.pos = end
+            return obj
+
+    def members(self):
+        """Recorre las claves de un objeto JSON; el valor queda por leer."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def items(self):
+        """Recorre los elementos de un arreglo JSON."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("]")
+            return
+
+    def events(self):
+        """
+        Genera ("metadata", dict), ("record", modelo, registro) y
+        ("deleted", modelo, ids) en el orden en que aparecen en el archivo.
+        """
+        for key in self.members():
+            if key == "data":
+                for model_name in self.members():
+                    for record in self.items():
+                        yield "record", model_name, record
+            elif key == "metadata":
+                yield "metadata", self.value()
+            elif key == "deleted":
+                for model_name in self.members():
+                    yield "deleted", model_name, self.value()
+            else:
+                self.value()
+
+
+def open_backup(fileobj):
+    """Abre un respaldo subido (JSON o JSON comprimido con gzip) como texto."""
+    if hasattr(fileobj, "seek"):
+        magic = fileobj.read(2)
+        fileobj.seek(0)
+        if magic == b"\x1f\x8b":
+            fileobj = gzip.GzipFile(fileobj=fileobj)
+    return io.TextIOWrapper(fileobj, encoding="utf-8")
+
+
+def read_backup_metadata(fileobj):
+    """
+    Lee solo la metadata de un respaldo subido (está al inicio del archivo)
+    y deja el archivo listo para leerse de nuevo desde el principio.
+    """
+    stream = open_backup(fileobj)
+    try:
+        for event in BackupReader(stream).events():
+            if event[0] == "metadata":
+                return event[1]
+            break
+        return {}
+    finally:
+        stream.detach()
+        fileobj.seek(0)
+
+
+def backup_sequence(metadatas):
+    """
+    Ordena los respaldos a aplicar: primero el completo (si hay) y luego
+    los incrementales por checkpoint. Falla si entre dos incrementales
+    queda un hueco sin cubrir. Devuelve los índices en orden.
+    """
+    order = sorted(
+        range(len(metadatas)),
+        key=lambda i: (metadatas[i].get("type", "full") != "full",
+                       metadatas[i].get("checkpoint") or ""),
+    )
+    previous = None
+    for i in order:
+        metadata = metadatas[i]
+        if metadata.get("type") == "delta" and previous is not None:
+            if parse_checkpoint(metadata["since"]) > previous:
+                raise ValueError(
+                    f"Falta un respaldo incremental entre {previous.isoformat()} "
+                    f"y {metadata['since']}")
+        if metadata.get("checkpoint"):
+            previous = parse_checkpoint(metadata["checkpoint"])
+    return order
+
+
+def insert_records(model, objs):
+    """
+    INSERT de `objs` con sus valores tal cual, en lotes del tamaño que
+    admite la base. A diferencia de bulk_create no pasa por pre_save, así
+    que los auto_now/auto_now_add guardan las fechas del respaldo en el
+    mismo INSERT en vez de la hora actual.
+    """
+    fields = model._meta.concrete_fields
+    queryset = model._base_manager.all()
+    batch_size = connection.ops.bulk_batch_size(fields, objs) or len(objs)
+    for start in range(0, len(objs), batch_size):
+        queryset._insert(objs[start:start + batch_size], fields=fields, raw=True)
+
+
+def save_batch(model, records):
+    """
+    Inserta o actualiza un lote de registros por pk con `insert_records` y
+    bulk_update. No llama a save(), así que no se aplican los efectos de
+    Purchase.save/Sale.save sobre el stock: este se restaura tal cual.
+    """
+    objs = [d.object for d in serializers.deserialize("python", records)]
+    existing = set(model.objects.filter(
+        pk__in=[obj.pk for obj in objs]).values_list("pk", flat=True))
+    to_update = [obj for obj in objs if obj.pk in existing]
+    to_create = [obj for obj in objs if obj.pk not in existing]
+
+    if to_update:
+        fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+        model.objects.bulk_update(to_update, [f.name for f in fields])
+    if to_create:
+        insert_records(model, to_create)
+    return len(objs)
+
+
+def sync_line_dates():
+    """
+    Copia la fecha de la factura a las líneas que no la tienen igual
+    (respaldos anteriores a que las líneas guardaran su fecha).
+    """
+    for name in ("Purchase", "Sale"):
+        model = apps.get_model("stock", name)
+        invoice = model._meta.get_field("invoice").related_model
+        model.objects.exclude(date=F("invoice__date")).update(date=Subquery(
+            invoice.objects.filter(pk=OuterRef("invoice_id")).values("date")[:1]))
+
+
+def line_keys(model, field, ids, batch_size=IMPORT_BATCH_SIZE):
+    """(día, producto) de las líneas de `model` cuyo `field` está en `ids`."""
+    ids = list(ids)
+    keys = set()
+    for start in range(0, len(ids), batch_size):
+        keys.update(model.objects.filter(
+            **{f"{field}__in": ids[start:start + batch_size]},
+        ).values_list("date", "product_id"))
+    return keys
+
+
+def import_backup(stream, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Restaura un respaldo (completo o incremental) leyéndolo por partes e
+    insertando por lotes, todo dentro de una transacción: si algo falla no
+    queda nada a medias. Los borrados de un incremental se aplican al final.
+
+    Devuelve (filas por modelo, eliminados por modelo, metadata, segundos,
+    afectados). En un incremental, `afectados` tiene los (día, producto)
+    de las líneas de "Purchase" y "Sale" que cambiaron, antes y después
+    de importar, y en "Product" los productos importados; con eso se
+    corrigen solo esas partes del resumen diario y del libro.
+    """
+    started = time.monotonic()
+    counts = {}
+    deleted = {}
+    pending_deletes = {}
+    metadata = {}
+    touched = []
+    # Facturas cuyos totales guardados hay que recalcular al final
+    invoices = {name: set() for name in LINE_INVOICES.values()}
+    affected = {"Purchase": set(), "Sale": set(), "Product": set()}
+    lines = {name: set() for name in LINE_INVOICES}
+    batch = []
+    batch_model = None
+
+    def flush():
+        if batch:
+            model = apps.get_model("stock", batch_model)
+            if metadata.get("type") == "delta":
+                # Días y productos que tenían las filas antes de reemplazarlas
+                pks = [record["pk"] for record in batch]
+                if batch_model in LINE_INVOICES:
+                    lines[batch_model].update(pks)
+                    affected[batch_model] |= line_keys(model, "pk", pks)
+                elif batch_model in invoices:
+                    for line_name, invoice_name in LINE_INVOICES.items():
+                        if invoice_name == batch_model:
+                            affected[line_name] |= line_keys(
+                                apps.get_model("stock", line_name), "invoice_id", pks)
+                elif batch_model == "Product":
+                    affected["Product"].update(pks)
+            counts[batch_model] = counts.get(batch_model, 0) + save_batch(model, batch)
+            if model not in touched:
+                touched.append(model)
+            batch.clear()
+
+    with transaction.atomic():
+        for event in BackupReader(stream).events():
+            if event[0] == "metadata":
+                metadata = event[1]
+                continue
+            if event[1] not in BACKUP_MODELS:
+                continue
+            if event[0] == "deleted":
+                pending_deletes.setdefault(event[1], []).extend(event[2])
+                continue
+            _, model_name, record = event
+            if model_name in LINE_INVOICES:
+                invoices[LINE_INVOICES[model_name]].add(record["fields"]["invoice"])
+            elif model_name in invoices:
+                invoices[model_name].add(record["pk"])
+            if model_name != batch_model or len(batch) >= batch_size:
+                flush()
+                batch_model = model_name
+            batch.append(record)
+        flush()
+
+        # Borrados en orden inverso de dependencias. Son borrados de
+        # queryset: no revierten stock, que ya viene en el respaldo.
+        for model_name in reversed(BACKUP_MODELS):
+            ids = pending_deletes.get(model_name)
+            if not ids:
+                continue
+            model = apps.get_model("stock", model_name)
+            for start in range(0, len(ids), batch_size):
+                chunk = ids[start:start + batch_size]
+                rows = model.objects.filter(pk__in=chunk)
+                if model_name in LINE_INVOICES:
+                    invoices[LINE_INVOICES[model_name]].update(
+                        rows.values_list("invoice_id", flat=True))
+                    affected[model_name] |= line_keys(model, "pk", chunk)
+                for line_name, invoice_name in LINE_INVOICES.items():
+                    if invoice_name == model_name:
+                        affected[line_name] |= line_keys(
+                            apps.get_model("stock", line_name), "invoice_id", chunk)
+                rows.delete()
+            deleted[model_name] = len(ids)
+
+        sync_line_dates()
+        if metadata.get("type") == "delta":
+            # Días y productos de las líneas importadas, ya con su fecha
+            for line_name, invoice_name in LINE_INVOICES.items():
+                model = apps.get_model("stock", line_name)
+                affected[line_name] |= line_keys(model, "pk", lines[line_name])
+                affected[line_name] |= line_keys(
+                    model, "invoice_id", invoices[invoice_name])
+        for model_name, ids in invoices.items():
+            # Las facturas borradas en el mismo respaldo ya no se encuentran
+            refresh_invoice_totals(apps.get_model("stock", model_name), ids)
+
+        # Ajustar las secuencias de pk tras insertar ids explícitos
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), touched):
+                cursor.execute(sql)
+
+    return counts, deleted, metadata, time.monotonic() - started, affected
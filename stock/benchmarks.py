@@ -0,0 +1,190 @@
+import statistics
+import time
+import tracemalloc
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Product, SaleInvoice
+from .seeding import clear_stock_data
+
+LIST_MODELS = ["category", "product", "sale", "purchase", "expense",
+               "expensecategory", "otherincome", "otherincomecategory"]
+
+# Diferencia mínima en ms para considerar una regresión de tiempo (ruido)
+NOISE_MS = 5
+
+
+def formset_post(lines, initial=0, **fields):
+    """Datos POST de una factura con su formset de líneas (`items`)."""
+    data = dict(fields)
+    data.update({
+        "items-TOTAL_FORMS": str(len(lines)),
+        "items-INITIAL_FORMS": str(initial),
+        "items-MIN_NUM_FORMS": "0",
+        "items-MAX_NUM_FORMS": "1000",
+    })
+    for i, line in enumerate(lines):
+        for field, value in line.items():
+            data[f"items-{i}-{field}"] = str(value)
+    return data
+
+
+def checked(response, name, keep=True):
+    """
+    Falla si la respuesta es un error y consume el contenido (las
+    descargas se generan por partes). Con keep=False solo lo recorre.
+    """
+    if response.status_code >= 400:
+        raise RuntimeError(f"{name}: respuesta {response.status_code}")
+    if not hasattr(response, "streaming_content"):
+        return response.content
+    if keep:
+        return b"".join(response.streaming_content)
+    for _chunk in response.streaming_content:
+        pass
+    return b""
+
+
+def rolled_back(run):
+    """
+    Envuelve `run` en una transacción que se deshace al terminar, para que
+    repetir un POST no vaya agregando facturas ni cambiando los datos.
+    """
+    def wrapper():
+        with transaction.atomic():
+            result = run()
+            transaction.set_rollback(True)
+        return result
+    return wrapper
+
+
+def bench_cases(client):
+    """
+    Casos a medir: (nombre, preparar). `preparar()` deja todo listo fuera
+    de la medición (caché vacía, datos del POST) y devuelve la función
+    que se mide. Las páginas se miden sin caché, como la primera visita
+    después de un cambio; los POST de facturas se deshacen en cada corrida.
+    """
+    def get(name, url):
+        def prepare():
+            cache.clear()
+            return lambda: checked(client.get(url), name)
+        return name, prepare
+
+    def purchase_new():
+        products = list(Product.objects.order_by("?").values_list("pk", flat=True)[:5])
+        data = formset_post(
+            [{"product": pk, "quantity": 5, "cost": "10.00"} for pk in products],
+            date=time.strftime("%Y-%m-%d"), supplier="Benchmark")
+        url = reverse("purchase_invoice_new")
+        return rolled_back(lambda: checked(client.post(url, data), "invoice:purchase_new"))
+
+    def sale_edit():
+        invoice = SaleInvoice.objects.order_by("-pk").first()
+        lines = [
+            {"id": pk, "product": product_id, "quantity": quantity % 5 + 1}
+            for pk, product_id, quantity in invoice.items.values_list(
+                "pk", "product_id", "quantity")
+        ]
+        data = formset_post(lines, initial=len(lines),
+                            date=invoice.date.isoformat(), customer=invoice.customer)
+        url = reverse("sale_invoice_edit", args=[invoice.pk])
+        return rolled_back(lambda: checked(client.post(url, data), "invoice:sale_edit"))
+
+    def export():
+        url = reverse("export_data")
+        return lambda: checked(client.get(url), "export_data", keep=False)
+
+    def import_():
+        # Restauración completa sobre una base vacía: deja los mismos datos
+        backup = checked(client.get(reverse("export_data"), {"gzip": "1"}),
+                         "export_data")
+        clear_stock_data()
+        url = reverse("import_data")
+
+        def run():
+            upload = SimpleUploadedFile("backup.json.gz", backup,
+                                        content_type="application/gzip")
+            return checked(client.post(url, {"backup_file": upload}), "import_data")
+        return run
+
+    cases = [
+        get("home", reverse("home")),
+        get("month_result", reverse("month_result", args=[0])),
+        get("top_products", reverse("top_products")),
+    ]
+    for model in LIST_MODELS:
+        cases.append(get(f"list:{model}", reverse("list_data", args=[model])))
+    cases += [
+        ("invoice:purchase_new", purchase_new),
+        ("invoice:sale_edit", sale_edit),
+        ("export_data", export),
+        ("import_data", import_),
+    ]
+    return cases
+
+
+def measure(prepare, repeat=3):
+    """
+    Ejecuta el caso `repeat` veces midiendo el tiempo y una vez más con
+    tracemalloc y captura de consultas (que agregan costo propio).
+    """
+    times = []
+    for _ in range(repeat):
+        run = prepare()
+        started = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - started) * 1000)
+
+    run = prepare()
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as ctx:
+            run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "wall_ms": round(statistics.median(times), 2),
+        "min_ms": round(min(times), 2),
+        "queries": len(ctx),
+        "peak_kb": round(peak / 1024),
+    }
+
+
+def run_benchmarks(client, repeat=3, log=None):
+    """Mide todos los casos y devuelve {caso: métricas}."""
+    results = {}
+    for name, prepare in bench_cases(client):
+        results[name] = measure(prepare, repeat)
+        if log:
+            log(name, results[name])
+    return results
+
+
+def compare_results(results, baseline, tolerance=0.25):
+    """
+    Compara dos resultados {tamaño: {caso: métricas}} y devuelve la lista
+    de regresiones: más consultas que la base o un tiempo mayor que la
+    base por más de `tolerance` (fracción) y de NOISE_MS.
+    """
+    regressions = []
+    for size, cases in results.items():
+        for name, metrics in cases.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            if metrics["queries"] > base["queries"]:
+                regressions.append(
+                    f"{size} {name}: {metrics['queries']} consultas "
+                    f"(base {base['queries']})")
+            limit = base["wall_ms"] * (1 + tolerance)
+            if metrics["wall_ms"] > limit and metrics["wall_ms"] - base["wall_ms"] > NOISE_MS:
+                regressions.append(
+                    f"{size} {name}: {metrics['wall_ms']:.1f} ms "
+                    f"(base {base['wall_ms']:.1f} ms)")
+    return regressions
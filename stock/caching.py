@@ -0,0 +1,62 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+DATA_VERSION_KEY = "stock:data_version"
+DASHBOARD_TIMEOUT = 60 * 60 * 24
+
+
+def data_version():
+    """Versión global de los datos; cambia con cada venta, compra, gasto, etc."""
+    version = cache.get(DATA_VERSION_KEY)
+    if version is None:
+        cache.add(DATA_VERSION_KEY, 1, timeout=None)
+        version = cache.get(DATA_VERSION_KEY, 1)
+    return version
+
+
+def bump_data_version():
+    """
+    Invalida todo lo calculado con la versión actual. Se aplica al
+    confirmar la transacción para que nadie guarde en caché datos viejos
+    con la versión nueva.
+    """
+    def bump():
+        try:
+            cache.incr(DATA_VERSION_KEY)
+        except ValueError:
+            cache.set(DATA_VERSION_KEY, 2, timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def dashboard_key(today_date, sales_window, version):
+    return f"stock:dashboard:{today_date.isoformat()}:{sales_window}:{version}"
+
+
+def cached_dashboard(today_date, sales_window, compute):
+    """
+    Devuelve el contexto del dashboard desde la caché o lo calcula con
+    `compute()` y lo guarda junto con la hora de cálculo.
+    """
+    key = dashboard_key(today_date, sales_window, data_version())
+    entry = cache.get(key)
+    if entry is None:
+        entry = {"computed_at": time.time(), "context": compute()}
+        cache.set(key, entry, timeout=DASHBOARD_TIMEOUT)
+    return entry["context"]
+
+
+def cache_is_shared():
+    """Si todos los procesos ven la misma caché (no la memoria de cada uno)."""
+    return not settings.CACHES["default"]["BACKEND"].endswith("LocMemCache")
+
+
+def dashboard_age(today_date, sales_window):
+    """Segundos desde que se calculó el dashboard en caché, o None si no está."""
+    entry = cache.get(dashboard_key(today_date, sales_window, data_version()))
+    if entry is None:
+        return None
+    return time.time() - entry["computed_at"]
@@ -0,0 +1,300 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from heapq import merge
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from .ledger import (CENT, balances_as_of, movement_date, movement_key,
+                     record_movements)
+from .models import Product, Purchase, Sale, StockMovement
+from .rollups import apply_sale_deltas
+
+PURCHASE = StockMovement.PURCHASE
+SALE = StockMovement.SALE
+ADJUSTMENT = StockMovement.ADJUSTMENT
+
+
+def receive(stock, average_cost, quantity, unit_cost):
+    """
+    Costo promedio móvil después de recibir `quantity` unidades a
+    `unit_cost`. Si no había stock, el costo pasa a ser el de la entrada.
+    """
+    total = stock + quantity
+    if stock <= 0 or total <= 0:
+        return Decimal(unit_cost)
+    return ((stock * average_cost + quantity * unit_cost) / total).quantize(CENT)
+
+
+def replay(events, stock=0, average_cost=Decimal(0)):
+    """
+    Reproduce en orden los eventos de un producto con costo promedio móvil.
+    Cada evento es (product_id, fecha, creado, tipo, cantidad, costo, id).
+
+    Las ventas no cambian el costo promedio y llegar a stock 0 no lo borra:
+    la siguiente compra parte del costo anterior solo si queda stock.
+    Devuelve (stock, costo promedio, {id de venta: costo aplicado}).
+    """
+    sale_costs = {}
+    for _, _, _, kind, quantity, unit_cost, source_id in events:
+        if kind == SALE:
+            sale_costs[source_id] = average_cost
+            stock -= quantity
+        elif quantity > 0:
+            # Compras y ajustes que agregan unidades entran al promedio
+            average_cost = receive(stock, average_cost, quantity, unit_cost)
+            stock += quantity
+        else:
+            stock += quantity
+    return stock, average_cost, sale_costs
+
+
+def line_events(model, kind, product_ids, since=None):
+    lines = model.objects.filter(product_id__in=product_ids)
+    if since is not None:
+        lines = lines.filter(date__gte=since)
+    rows = (
+        lines.order_by("product_id", "date", "created_at", "pk")
+        .values_list("product_id", "date", "created_at",
+                     "quantity", "cost", "pk")
+    )
+    for product_id, day, created_at, quantity, cost, pk in rows.iterator(chunk_size=5000):
+        yield product_id, day, created_at, kind, quantity, cost, pk
+
+
+def adjustment_events(product_ids, since=None):
+    adjustments = StockMovement.objects.filter(
+        product_id__in=product_ids, kind=ADJUSTMENT,
+    ).exclude(quantity=0)
+    if since is not None:
+        adjustments = adjustments.filter(date__gte=since)
+    rows = (
+        adjustments.order_by("product_id", "date", "created_at", "pk")
+        .values_list("product_id", "date", "created_at",
+                     "quantity", "unit_cost", "pk")
+    )
+    for product_id, day, created_at, quantity, cost, pk in rows.iterator(chunk_size=5000):
+        yield product_id, day, created_at, ADJUSTMENT, quantity, cost, pk
+
+
+def product_events(product_ids, since=None):
+    """
+    Compras, ventas y ajustes de stock de los productos como un solo flujo
+    ordenado por (producto, fecha, creado), sin cargar la historia en memoria.
+    Los ajustes solo de valor se omiten: son la diferencia que se corrige.
+    """
+    return merge(
+        line_events(Purchase, PURCHASE, product_ids, since),
+        line_events(Sale, SALE, product_ids, since),
+        adjustment_events(product_ids, since),
+        key=itemgetter(0, 1, 2),
+    )
+
+
+def replay_products(product_ids):
+    """
+    Reproduce la historia completa de un bloque de productos.
+    Devuelve {product_id: (stock, costo promedio)}; los productos sin
+    movimientos quedan en (0, 0). Se ejecuta en los procesos del pool.
+    """
+    results = {product_id: (0, Decimal(0)) for product_id in product_ids}
+    for product_id, events in groupby(product_events(product_ids), key=itemgetter(0)):
+        stock, average_cost, _ = replay(events)
+        results[product_id] = (stock, average_cost)
+    return results
+
+
+def ledger_totals(product_ids):
+    """Stock y valor que suma el libro para cada producto."""
+    rows = (
+        StockMovement.objects.filter(product_id__in=product_ids)
+        .order_by().values_list("product_id")
+        .annotate(qty=Sum("quantity"), total=Sum("value"))
+    )
+    return {product_id: (quantity, value) for product_id, quantity, value in rows}
+
+
+def correction_movement(product_id, ledger, stock, average_cost, day):
+    """
+    Movimiento que lleva el saldo del libro (`ledger` = (stock, valor)) al
+    stock y costo reconstruidos. Es una revalorización, así que la
+    siguiente reconstrucción no lo vuelve a aplicar.
+    """
+    quantity, value = ledger
+    return StockMovement(
+        date=day,
+        product_id=product_id,
+        kind=StockMovement.REVALUATION,
+        quantity=stock - quantity,
+        unit_cost=average_cost,
+        value=(Decimal(stock * average_cost) - value).quantize(CENT),
+    )
+
+
+def product_chunks(chunk_size):
+    ids = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+    return [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+
+# ===== Recálculo incremental =====
+
+def states_before(product_ids, day):
+    """
+    Stock y costo promedio de los productos al cierre del día anterior a
+    `day`, desde el libro (instantánea más movimientos posteriores).
+    Sin stock, el costo es el de la última compra anterior.
+    Devuelve {product_id: (stock, costo promedio)}.
+    """
+    balances = balances_as_of(day - timedelta(days=1), product_ids)
+    states = {}
+    empty = []
+    for product_id in product_ids:
+        stock, value = balances.get(product_id, (0, 0))
+        if stock > 0:
+            states[product_id] = (stock, (Decimal(value) / stock).quantize(CENT))
+        else:
+            states[product_id] = (stock, Decimal(0))
+            empty.append(product_id)
+    if empty:
+        last_cost = (
+            Purchase.objects.filter(product=OuterRef("pk"), date__lt=day)
+            .order_by("-date", "-created_at").values("cost")[:1]
+        )
+        rows = (
+            Product.objects.filter(pk__in=empty)
+            .annotate(last_cost=Subquery(last_cost))
+            .values_list("pk", "last_cost")
+        )
+        for product_id, cost in rows:
+            states[product_id] = (states[product_id][0], cost or Decimal(0))
+    return states
+
+
+def recompute_costs(changes, batch_size=500):
+    """
+    Recalcula el costo promedio móvil de cada producto de `changes`
+    ({product_id: primera fecha afectada}) desde esa fecha en adelante.
+
+    Solo se reproducen los eventos desde la fecha editada. Las ventas
+    cuyo costo cambia se actualizan en bloque y la diferencia se refleja
+    en el resumen diario y en el libro (revalorización), así que la
+    historia anterior queda intacta. Los productos que comparten fecha se
+    procesan juntos, con la misma cantidad de consultas para uno o para
+    toda una factura. Debe llamarse dentro de una transacción.
+    """
+    now = timezone.now()
+    by_day = defaultdict(list)
+    for product_id, day in changes.items():
+        by_day[day].append(product_id)
+
+    for day, product_ids in sorted(by_day.items()):
+        states = states_before(product_ids, day)
+        sale_costs = {}
+        for product_id, events in groupby(
+                product_events(product_ids, since=day), key=itemgetter(0)):
+            stock, average_cost, costs = replay(events, *states[product_id])
+            states[product_id] = (stock, average_cost)
+            sale_costs.update(costs)
+
+        # (fecha, producto) → diferencia de costo (positiva si la venta costó más)
+        cost_deltas = defaultdict(Decimal)
+        ids = list(sale_costs)
+        for start in range(0, len(ids), batch_size):
+            sales = Sale.objects.filter(
+                pk__in=ids[start:start + batch_size],
+            ).values_list("pk", "product_id", "quantity", "cost", "date")
+            changed = []
+            for pk, product_id, quantity, old_cost, sale_date in sales:
+                cost = sale_costs[pk]
+                if cost == old_cost:
+                    continue
+                cost_deltas[sale_date, product_id] += quantity * (cost - old_cost)
+                changed.append(Sale(pk=pk, cost=cost, updated_at=now))
+            Sale.objects.bulk_update(changed, ["cost", "updated_at"])
+
+        apply_sale_deltas({key: (0, 0, 0, delta) for key, delta in cost_deltas.items()})
+        record_movements([
+            StockMovement(date=sale_date, product_id=product_id,
+                          kind=StockMovement.REVALUATION, value=-delta)
+            for (sale_date, product_id), delta in cost_deltas.items()
+        ])
+
+        # El redondeo del costo promedio deja una diferencia entre el valor
+        # del libro y stock × costo: se cierra con una revalorización para
+        # que inventory_value/valuation_as_of coincidan con Product
+        ledger = ledger_totals(product_ids)
+        record_movements([
+            correction_movement(product_id, ledger.get(product_id, (0, Decimal(0))),
+                                stock, average_cost, max(day, now.date()))
+            for product_id, (stock, average_cost) in states.items()
+        ])
+
+        products = [
+            Product(pk=product_id, average_cost=states[product_id][1],
+                    updated_at=now)
+            for product_id, current in Product.objects.filter(
+                pk__in=product_ids).values_list("pk", "average_cost")
+            if current != states[product_id][1]
+        ]
+        Product.objects.bulk_update(products, ["average_cost", "updated_at"])
+
+
+def line_changes(old, new):
+    """
+    Productos y fecha desde la que hay que recalcular costos tras guardar
+    una línea. Una línea nueva de hoy no afecta nada posterior.
+    """
+    if old is None and new is not None \
+            and movement_date(new.invoice.date) >= timezone.now().date():
+        return {}
+    if old is not None and new is not None and movement_key(old) == movement_key(new):
+        return {}
+    changes = {}
+    for line in (old, new):
+        if line is not None:
+            add_change(changes, line.product_id, movement_date(line.invoice.date))
+    return later_changes(changes, new or old)
+
+
+def later_changes(changes, line):
+    """
+    Deja de `changes` solo los productos con compras, ventas o ajustes
+    posteriores a `line` (por fecha y, el mismo día, por creación). Sin
+    nada posterior el posteo directo ya dejó el stock y el costo como los
+    dejaría la reproducción, así que no hace falta repetirla. Una consulta.
+    """
+    match = Q()
+    for product_id, day in changes.items():
+        match |= Q(product_id=product_id) & (
+            Q(date__gt=day) | Q(date=day, created_at__gt=line.created_at))
+    if not match:
+        return changes
+    purchases = Purchase.objects.filter(match)
+    sales = Sale.objects.filter(match)
+    if isinstance(line, Purchase):
+        purchases = purchases.exclude(pk=line.pk)
+    else:
+        sales = sales.exclude(pk=line.pk)
+    adjustments = StockMovement.objects.filter(match, kind=ADJUSTMENT).exclude(quantity=0)
+    later = set(
+        purchases.order_by().values_list("product_id", flat=True)
+        .union(sales.order_by().values_list("product_id", flat=True),
+               adjustments.order_by().values_list("product_id", flat=True))
+    )
+    return {product_id: day for product_id, day in changes.items()
+            if product_id in later}
+
+
+def invoice_changes(invoice, old_date):
+    """Productos de una factura cuya fecha cambió, desde la fecha más antigua."""
+    day = min(old_date, movement_date(invoice.date))
+    product_ids = invoice.items.order_by().values_list("product_id", flat=True)
+    return {product_id: day for product_id in set(product_ids)}
+
+
+def add_change(changes, product_id, day):
+    if product_id not in changes or day < changes[product_id]:
+        changes[product_id] = day
@@ -1,4 +1,6 @@
 from django import forms
+from django.core.exceptions import ValidationError
+from django.utils.functional import cached_property
 from .models import (
     Category, ExpenseCategory, Product, ProductImage,
     Purchase, Sale, Expense,
@@ -20,10 +22,36 @@ class ExpenseCategoryForm(forms.ModelForm):
 
 
 class ProductForm(forms.ModelForm):
+    """
+    El stock y el costo promedio no se guardan con el resto del producto:
+    la vista los aplica como ajuste bajo bloqueo y solo si siguen siendo
+    los que se mostraron (`shown_stock`, `shown_average_cost`), para no
+    pisar ventas o compras registradas mientras se editaba.
+    """
+    stock = forms.IntegerField(initial=0)
+    average_cost = forms.DecimalField(max_digits=10, decimal_places=2, initial=0)
+    shown_stock = forms.IntegerField(widget=forms.HiddenInput, required=False)
+    shown_average_cost = forms.DecimalField(
+        max_digits=10, decimal_places=2, widget=forms.HiddenInput, required=False)
+
     class Meta:
         model = Product
-        fields = ["name", "category", "brand", "description",
-                  "stock", "price", "average_cost"]
+        fields = ["name", "category", "brand", "description", "price"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in ("stock", "average_cost"):
+            value = getattr(self.instance, name)
+            self.fields[name].initial = value
+            self.fields[f"shown_{name}"].initial = value
+        self.order_fields(["name", "category", "brand", "description",
+                           "stock", "price", "average_cost"])
+
+    def stock_changed(self):
+        """Si se pidió un stock o costo distinto del que se mostró."""
+        data = self.cleaned_data
+        return ((data["stock"], data["average_cost"])
+                != (data["shown_stock"], data["shown_average_cost"]))
 
 
 # Formset para gestionar múltiples fotos de un producto
@@ -58,6 +86,81 @@ class OtherIncomeForm(forms.ModelForm):
         }
 
 
+# ===== Líneas de factura =====
+class LoadedModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField que valida contra objetos ya cargados (`loaded`,
+    {pk: objeto}) en vez de consultar la base por cada formulario.
+    Sin `loaded` se comporta como un ModelChoiceField normal.
+    """
+    loaded = None
+
+    def to_python(self, value):
+        if self.loaded is None or value in self.empty_values:
+            return super().to_python(value)
+        model = self.queryset.model
+        if isinstance(value, model):
+            value = value.pk
+        try:
+            return self.loaded[model._meta.pk.to_python(value)]
+        except (KeyError, ValidationError):
+            raise ValidationError(
+                self.error_messages["invalid_choice"],
+                code="invalid_choice", params={"value": value},
+            )
+
+
+class InvoiceItemForm(forms.ModelForm):
+    """
+    Base de los formularios de línea. Si el formset ya resolvió el producto
+    contra los productos cargados, no se repite la validación del modelo
+    (que comprobaría su existencia con una consulta por línea).
+    """
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        if getattr(self.fields["product"], "loaded", None) is not None:
+            exclude.add("product")
+        return exclude
+
+
+class InvoiceItemFormSet(forms.BaseInlineFormSet):
+    """
+    Formset de líneas de factura con una cantidad de consultas que no
+    depende de las líneas: las opciones del selector de producto se
+    cargan una vez para todos los formularios y, al validar, los
+    productos enviados se traen en bloque y las líneas existentes salen
+    del queryset del formset.
+    """
+
+    @cached_property
+    def product_choices(self):
+        return list(self.form.base_fields["product"].choices)
+
+    @cached_property
+    def posted_products(self):
+        ids = set()
+        for i in range(self.total_form_count()):
+            value = self.data.get(f"{self.add_prefix(i)}-product", "")
+            if str(value).isdigit():
+                ids.add(int(value))
+        return Product.objects.in_bulk(ids)
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        form.fields["product"].choices = self.product_choices
+        if not self.is_bound:
+            return
+        form.fields["product"].loaded = self.posted_products
+        pk_name = self.model._meta.pk.name
+        pk_field = form.fields[pk_name]
+        form.fields[pk_name] = LoadedModelChoiceField(
+            pk_field.queryset, initial=pk_field.initial,
+            required=False, widget=pk_field.widget,
+        )
+        form.fields[pk_name].loaded = {obj.pk: obj for obj in self.get_queryset()}
+
+
 # ===== Facturas de compra =====
 class PurchaseInvoiceForm(forms.ModelForm):
     class Meta:
@@ -68,10 +171,11 @@ class PurchaseInvoiceForm(forms.ModelForm):
         }
 
 
-class PurchaseItemForm(forms.ModelForm):
+class PurchaseItemForm(InvoiceItemForm):
     class Meta:
         model = Purchase
         fields = ["product", "quantity", "cost"]
+        field_classes = {"product": LoadedModelChoiceField}
 
 
 # ===== Facturas de venta =====
@@ -84,7 +188,8 @@ class SaleInvoiceForm(forms.ModelForm):
         }
 
 
-class SaleItemForm(forms.ModelForm):
+class SaleItemForm(InvoiceItemForm):
     class Meta:
         model = Sale
-        fields = ["product", "quantity"]
\ No newline at end of file
+        fields = ["product", "quantity"]
+        field_classes = {"product": LoadedModelChoiceField}
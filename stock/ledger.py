@@ -0,0 +1,392 @@
+import calendar
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from .models import Product, Purchase, Sale, StockMovement, StockSnapshot
+
+CENT = Decimal("0.01")
+
+
+def movement_date(value):
+    """Fecha de una factura en memoria (el default de `date` es un datetime)."""
+    return StockMovement._meta.get_field("date").to_python(value)
+
+
+def line_movement(line, sign=1, day=None):
+    """
+    Movimiento de una línea de compra o venta guardada. Con `sign=-1`
+    devuelve su reverso, que se escribe al modificar o eliminar la línea.
+    """
+    if isinstance(line, Purchase):
+        kind, quantity, source = StockMovement.PURCHASE, line.quantity, "purchase"
+    else:
+        kind, quantity, source = StockMovement.SALE, -line.quantity, "sale"
+    quantity *= sign
+    return StockMovement(
+        date=movement_date(day or line.invoice.date),
+        product_id=line.product_id,
+        kind=kind,
+        quantity=quantity,
+        unit_cost=line.cost,
+        value=quantity * line.cost,
+        **{f"{source}_id": line.pk},
+    )
+
+
+def shift_snapshots(movements):
+    """
+    Suma los movimientos con fecha pasada a las instantáneas ya tomadas
+    desde esa fecha, para que sigan siendo válidas sin recalcularlas.
+    """
+    first = min(m.date for m in movements)
+    if not StockSnapshot.objects.filter(date__gte=first).exists():
+        return
+    deltas = defaultdict(lambda: [0, 0])
+    for m in movements:
+        delta = deltas[(m.product_id, m.date)]
+        delta[0] += m.quantity
+        delta[1] += m.value
+    for (product_id, day), (quantity, value) in deltas.items():
+        if quantity or value:
+            StockSnapshot.objects.filter(
+                product_id=product_id, date__gte=day,
+            ).update(stock=F("stock") + quantity, value=F("value") + value)
+
+
+def record_movements(movements):
+    """Agrega movimientos al libro con un solo INSERT."""
+    movements = [m for m in movements if m.quantity or m.value]
+    if not movements:
+        return
+    StockMovement.objects.bulk_create(movements)
+    shift_snapshots(movements)
+
+
+def movement_key(line):
+    return (line.product_id, line.quantity, line.cost,
+            movement_date(line.invoice.date))
+
+
+def record_line_change(old, new):
+    """
+    Escribe en el libro el cambio de una línea entre `old` y `new`
+    (cualquiera puede ser None): el reverso de la versión anterior y el
+    movimiento de la nueva. No escribe nada si no cambió lo que afecta al
+    inventario.
+    """
+    if old is not None and new is not None and movement_key(old) == movement_key(new):
+        return
+    movements = []
+    if old is not None:
+        movements.append(line_movement(old, -1))
+    if new is not None:
+        movements.append(line_movement(new))
+    record_movements(movements)
+
+
+def move_invoice_movements(invoice, old_date, new_date):
+    """Pasa los movimientos de las líneas de una factura a su nueva fecha."""
+    lines = list(invoice.items.all())
+    record_movements(
+        [line_movement(line, -1, old_date) for line in lines]
+        + [line_movement(line, 1, new_date) for line in lines]
+    )
+
+
+def record_adjustment(product, old_stock, old_average_cost, day=None):
+    """Registra como ajuste un cambio manual de stock o costo promedio."""
+    quantity = product.stock - old_stock
+    value = (Decimal(product.stock * product.average_cost)
+             - old_stock * old_average_cost).quantize(CENT)
+    record_movements([StockMovement(
+        date=day or timezone.now().date(),
+        product_id=product.pk,
+        kind=StockMovement.ADJUSTMENT,
+        quantity=quantity,
+        unit_cost=product.average_cost,
+        value=value,
+    )])
+
+
+def balances_as_of(day, product_ids=None):
+    """
+    Stock y valor de cada producto al cierre de `day`: la última
+    instantánea de cada producto más los movimientos posteriores a ella.
+    El trabajo depende del espaciado entre instantáneas, no de la historia.
+
+    Devuelve {product_id: [stock, valor]} con los productos que tienen
+    movimientos hasta `day`, o solo los de `product_ids` si se indica.
+    """
+    snapshot_rows = StockSnapshot.objects.all()
+    movements = StockMovement.objects.all()
+    products = Product.objects.all()
+    if product_ids is not None:
+        snapshot_rows = snapshot_rows.filter(product_id__in=product_ids)
+        movements = movements.filter(product_id__in=product_ids)
+        products = products.filter(pk__in=product_ids)
+
+    latest = (
+        StockSnapshot.objects.filter(product=OuterRef("product"), date__lte=day)
+        .order_by("-date").values("date")[:1]
+    )
+    snapshots = snapshot_rows.filter(
+        date__lte=day, date=Subquery(latest),
+    ).values_list("product_id", "date", "stock", "value")
+
+    base = {}
+    balances = {}
+    for product_id, snapshot_date, stock, value in snapshots:
+        base[product_id] = snapshot_date
+        balances[product_id] = [stock, value]
+
+    tail = movements.filter(date__lte=day)
+    start = min(base.values(), default=None)
+    if start is not None:
+        tail = tail.filter(date__gt=start)
+    grouped = (
+        tail.order_by().values_list("product_id", "date")
+        .annotate(qty=Sum("quantity"), total=Sum("value"))
+    )
+    for product_id, movement_date, quantity, value in grouped:
+        if product_id in base and movement_date <= base[product_id]:
+            continue
+        balance = balances.setdefault(product_id, [0, Decimal(0)])
+        balance[0] += quantity
+        balance[1] += value
+
+    if start is not None:
+        # Productos sin instantánea: su historia anterior a `start` completa
+        unsnapshotted = products.filter(
+            ~Exists(StockSnapshot.objects.filter(
+                product=OuterRef("pk"), date__lte=day))
+        ).values("pk")
+        older = (
+            movements.filter(product__in=unsnapshotted, date__lte=start)
+            .order_by().values_list("product_id")
+            .annotate(qty=Sum("quantity"), total=Sum("value"))
+        )
+        for product_id, quantity, value in older:
+            balance = balances.setdefault(product_id, [0, Decimal(0)])
+            balance[0] += quantity
+            balance[1] += value
+    return balances
+
+
+def month_ends(first, last):
+    """Último día de cada mes desde el mes de `first` hasta `last` inclusive."""
+    ends = []
+    year, month = first.year, first.month
+    while True:
+        end = date(year, month, calendar.monthrange(year, month)[1])
+        if end > last:
+            return ends
+        ends.append(end)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def monthly_balances(ends):
+    """
+    Recorre el libro una sola vez ordenado por producto y fecha y genera
+    (product_id, fecha de cierre, stock, valor) para cada cierre de `ends`
+    desde el primer movimiento de cada producto.
+    """
+    if not ends:
+        return
+    rows = (
+        StockMovement.objects.filter(date__lte=ends[-1])
+        .order_by("product_id", "date")
+        .values_list("product_id", "date", "quantity", "value")
+        .iterator(chunk_size=5000)
+    )
+    for product_id, movements in groupby(rows, key=itemgetter(0)):
+        stock, value, i = 0, Decimal(0), None
+        for _, day, quantity, amount in movements:
+            if i is None:
+                i = 0
+                while i < len(ends) and ends[i] < day:
+                    i += 1
+            while i < len(ends) and ends[i] < day:
+                yield product_id, ends[i], stock, value
+                i += 1
+            stock += quantity
+            value += amount
+        while i < len(ends):
+            yield product_id, ends[i], stock, value
+            i += 1
+
+
+def take_snapshot(day, batch_size=1000):
+    """Toma (o reemplaza) la instantánea de todos los productos al cierre de `day`."""
+    rows = [
+        StockSnapshot(product_id=product_id, date=day, stock=stock, value=value)
+        for product_id, (stock, value) in balances_as_of(day).items()
+    ]
+    with transaction.atomic():
+        StockSnapshot.objects.filter(date=day).delete()
+        StockSnapshot.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def take_monthly_snapshots(until, batch_size=1000):
+    """
+    Reemplaza las instantáneas por una al cierre de cada mes hasta `until`,
+    calculadas en una sola pasada sobre el libro.
+    """
+    first = StockMovement.objects.order_by("date").values_list(
+        "date", flat=True).first()
+    ends = month_ends(first, until) if first else []
+    created = 0
+    with transaction.atomic():
+        StockSnapshot.objects.all().delete()
+        batch = []
+        for product_id, day, stock, value in monthly_balances(ends):
+            batch.append(StockSnapshot(
+                product_id=product_id, date=day, stock=stock, value=value))
+            if len(batch) >= batch_size:
+                StockSnapshot.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        StockSnapshot.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+def reconciling_adjustments(totals, day=None, product_ids=None, first_dates=None):
+    """
+    Ajustes que cuadran el libro con el stock y costo actuales de cada
+    producto (o solo de `product_ids`). `totals` es
+    {product_id: (stock, valor)} según el libro.
+
+    Van fechados en `day` (hoy por defecto), salvo los productos de
+    `first_dates` ({product_id: fecha de su primer movimiento}): para
+    ellos el ajuste es el saldo inicial con que entran al libro y se
+    fecha el día anterior a su primer movimiento, así no cambia el
+    valor del inventario en las fechas posteriores.
+    """
+    day = day or timezone.now().date()
+    first_dates = first_dates or {}
+    products = Product.objects.only("stock", "average_cost")
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    for product in products.iterator(chunk_size=2000):
+        quantity, value = totals.get(product.pk, (0, 0))
+        target = Decimal(product.stock * product.average_cost).quantize(CENT)
+        if product.stock != quantity or target != value:
+            first = first_dates.get(product.pk)
+            yield StockMovement(
+                date=first - timedelta(days=1) if first else day,
+                product_id=product.pk,
+                kind=StockMovement.ADJUSTMENT,
+                quantity=product.stock - quantity,
+                unit_cost=product.average_cost,
+                value=target - value,
+            )
+
+
+def rebuild_ledger(batch_size=1000):
+    """
+    Reconstruye el libro desde las líneas de compra y venta guardadas,
+    más un ajuste por producto que lo cuadra con el stock y costo actuales
+    (stock inicial, cambios manuales). Ese ajuste es el saldo inicial del
+    producto: va fechado el día anterior a su primera línea.
+    Borra las instantáneas. Devuelve la cantidad de movimientos creados.
+    """
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    first_dates = {}
+    created = 0
+    with transaction.atomic():
+        StockSnapshot.objects.all().delete()
+        StockMovement.objects.all().delete()
+
+        batch = []
+        for model in (Purchase, Sale):
+            lines = model.objects.select_related("invoice").order_by(
+                "date", "created_at", "pk")
+            for line in lines.iterator(chunk_size=2000):
+                movement = line_movement(line)
+                movement.created_at = line.created_at
+                totals[line.product_id][0] += movement.quantity
+                totals[line.product_id][1] += movement.value
+                if movement.date < first_dates.get(line.product_id, date.max):
+                    first_dates[line.product_id] = movement.date
+                batch.append(movement)
+                if len(batch) >= batch_size:
+                    StockMovement.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+
+        batch.extend(reconciling_adjustments(totals, first_dates=first_dates))
+        StockMovement.objects.bulk_create(batch, batch_size=batch_size)
+        created += len(batch)
+    return created
+
+
+def refresh_line_movements(keys, product_ids=(), batch_size=200):
+    """
+    Reconstruye los movimientos de compra y venta de cada producto de
+    `keys` ({(día, producto)}) desde su día más antiguo, sin tocar sus
+    ajustes ni revalorizaciones, y corrige las instantáneas con la
+    diferencia. Luego cuadra con un ajuste de hoy los productos de `keys`
+    y `product_ids` cuyo stock o costo no coincide con el libro (cambios
+    manuales en el origen). Es lo que necesita una importación
+    incremental en vez de `rebuild_ledger`. Devuelve los movimientos creados.
+    """
+    starts = {}
+    for day, product_id in keys:
+        if product_id not in starts or day < starts[product_id]:
+            starts[product_id] = day
+    items = sorted(starts.items())
+    kinds = [StockMovement.PURCHASE, StockMovement.SALE]
+    created = 0
+    with transaction.atomic():
+        for start in range(0, len(items), batch_size):
+            match = Q()
+            for product_id, day in items[start:start + batch_size]:
+                match |= Q(product_id=product_id, date__gte=day)
+            old = StockMovement.objects.filter(match, kind__in=kinds)
+            changes = [
+                StockMovement(product_id=product_id, date=day,
+                              quantity=-quantity, value=-value)
+                for product_id, day, quantity, value in (
+                    old.order_by().values_list("product_id", "date")
+                    .annotate(qty=Sum("quantity"), total=Sum("value"))
+                )
+            ]
+            old.delete()
+
+            movements = []
+            for model in (Purchase, Sale):
+                lines = model.objects.filter(match).select_related(
+                    "invoice").order_by("date", "created_at", "pk")
+                for line in lines.iterator(chunk_size=2000):
+                    movement = line_movement(line)
+                    movement.created_at = line.created_at
+                    movements.append(movement)
+            StockMovement.objects.bulk_create(movements, batch_size=1000)
+            created += len(movements)
+            changes += movements
+            if changes:
+                shift_snapshots(changes)
+
+        reconcile = sorted(set(starts) | set(product_ids))
+        for start in range(0, len(reconcile), batch_size):
+            chunk = reconcile[start:start + batch_size]
+            totals = {
+                product_id: (quantity, value)
+                for product_id, quantity, value in (
+                    StockMovement.objects.filter(product_id__in=chunk)
+                    .order_by().values_list("product_id")
+                    .annotate(qty=Sum("quantity"), total=Sum("value"))
+                )
+            }
+            adjustments = list(reconciling_adjustments(totals, product_ids=chunk))
+            record_movements(adjustments)
+            created += len(adjustments)
+    return created
@@ -0,0 +1,139 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+
+from stock.caching import bump_data_version
+from stock.models import (Category, Product, Purchase, PurchaseInvoice, Sale,
+                          SaleInvoice)
+
+BENCH_NAME = "bench_db_writes"
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def database_profile():
+    """Descripción corta de la base configurada (motor y ajustes clave)."""
+    settings = connection.settings_dict
+    parts = [connection.vendor]
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            for pragma in ("journal_mode", "synchronous"):
+                cursor.execute(f"PRAGMA {pragma}")
+                parts.append(f"{pragma}={cursor.fetchone()[0]}")
+        mode = settings["OPTIONS"].get("transaction_mode") or "DEFERRED"
+        parts.append(f"transaction_mode={mode}")
+    elif settings["OPTIONS"].get("pool"):
+        parts.append("pool")
+    parts.append(f"conn_max_age={settings['CONN_MAX_AGE']}")
+    return " ".join(parts)
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide cuántas facturas de venta por segundo puede registrar la base "
+        "configurada con varios escritores a la vez. Crea sus propios "
+        "productos y facturas y los borra al terminar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--writers", default="1,4,8",
+            help="Escritores concurrentes a probar, separados por coma "
+                 "(por defecto 1,4,8).",
+        )
+        parser.add_argument(
+            "--invoices", type=int, default=50,
+            help="Facturas que registra cada escritor (por defecto 50).",
+        )
+        parser.add_argument(
+            "--lines", type=int, default=3,
+            help="Líneas por factura (por defecto 3).",
+        )
+        parser.add_argument(
+            "--products", type=int, default=5,
+            help="Productos entre los que se reparten las ventas; pocos "
+                 "productos significan más choques por la misma fila.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            writer_counts = [int(n) for n in options["writers"].split(",")]
+        except ValueError:
+            raise CommandError("--writers debe ser una lista de enteros, ej. 1,4,8")
+
+        self.stdout.write(f"Base: {database_profile()}")
+        products = self.create_products(options["products"])
+        try:
+            for writers in writer_counts:
+                self.run(writers, products, options["invoices"], options["lines"])
+        finally:
+            # Borrar los datos de prueba (en cascada: líneas, resumen y libro)
+            SaleInvoice.objects.filter(customer=BENCH_NAME).delete()
+            PurchaseInvoice.objects.filter(supplier=BENCH_NAME).delete()
+            Category.objects.filter(name=BENCH_NAME).delete()
+            bump_data_version()
+
+    def create_products(self, count):
+        category = Category.objects.create(name=BENCH_NAME)
+        invoice = PurchaseInvoice.objects.create(supplier=BENCH_NAME)
+        products = []
+        for i in range(count):
+            product = Product.objects.create(
+                name=f"{BENCH_NAME} {i}", category=category, price=Decimal("10.00"))
+            Purchase.objects.create(invoice=invoice, product=product,
+                                    quantity=1_000_000, cost=Decimal("6.00"))
+            products.append(product)
+        return products
+
+    def run(self, writers, products, invoices, lines):
+        latencies = [[] for _ in range(writers)]
+        errors = []
+        barrier = threading.Barrier(writers)
+
+        def writer(i):
+            try:
+                barrier.wait()
+                for n in range(invoices):
+                    started = time.perf_counter()
+                    try:
+                        with transaction.atomic():
+                            invoice = SaleInvoice.objects.create(customer=BENCH_NAME)
+                            for j in range(lines):
+                                product = products[(i + n + j) % len(products)]
+                                Sale.objects.create(invoice=invoice, product=product,
+                                                    quantity=1)
+                    except OperationalError as exc:
+                        # "database is locked" y similares: se cuentan, no detienen
+                        errors.append(str(exc))
+                        continue
+                    latencies[i].append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        done = [latency for writer_latencies in latencies for latency in writer_latencies]
+        self.stdout.write(
+            f"escritores={writers:<3} facturas={len(done):<6} "
+            f"facturas/s={len(done) / elapsed:8.1f} "
+            f"líneas/s={len(done) * lines / elapsed:8.1f} "
+            f"p50={percentile(done, 0.5) * 1000:7.1f}ms "
+            f"p95={percentile(done, 0.95) * 1000:7.1f}ms "
+            f"errores={len(errors)}"
+        )
+        if errors:
+            self.stdout.write(f"  primer error: {errors[0]}")
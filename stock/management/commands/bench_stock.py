@@ -0,0 +1,105 @@
+import json
+import platform
+import time
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from stock.benchmarks import compare_results, run_benchmarks
+from stock.seeding import clear_stock_data, seed_stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide tiempo, consultas y memoria de las vistas principales, la "
+        "carga de facturas y el respaldo con datos generados de varios "
+        "tamaños, y compara con una línea base. Usa una base de datos de "
+        "prueba aparte: no toca los datos reales."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", default="10000,100000,1000000",
+            help="Líneas de venta de cada conjunto de datos, separadas por "
+                 "coma (por defecto 10000,100000,1000000).",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=3,
+            help="Repeticiones medidas de cada caso (por defecto 3).",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=1,
+            help="Semilla de los datos generados.",
+        )
+        parser.add_argument(
+            "--output", default="bench_results.json",
+            help="Archivo JSON de resultados (por defecto bench_results.json).",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="Resultados anteriores con los que comparar; termina con "
+                 "error si hay regresiones.",
+        )
+        parser.add_argument(
+            "--tolerance", type=float, default=0.25,
+            help="Aumento de tiempo tolerado respecto de la base (por defecto 0.25).",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes debe ser una lista de enteros, ej. 10000,100000")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as f:
+                baseline = json.load(f)["results"]
+
+        report = {
+            "created": timezone.now().isoformat(),
+            "vendor": connection.vendor,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "repeat": options["repeat"],
+            "results": {},
+        }
+
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            client = Client()
+            client.force_login(User.objects.create_superuser("benchmark"))
+            for size in sizes:
+                clear_stock_data()
+                started = time.monotonic()
+                seed_stock(sale_lines=size, products=min(max(size // 500, 200), 5000),
+                           seed=options["seed"])
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f"{size} líneas de venta (datos generados en "
+                    f"{time.monotonic() - started:.1f} s)"))
+                report["results"][str(size)] = run_benchmarks(
+                    client, options["repeat"], log=self.log_case)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(options["output"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"Resultados guardados en {options['output']}.")
+
+        if baseline is not None:
+            regressions = compare_results(report["results"], baseline,
+                                          options["tolerance"])
+            if regressions:
+                for regression in regressions:
+                    self.stdout.write(self.style.ERROR(regression))
+                raise CommandError(f"{len(regressions)} regresiones respecto de la base.")
+            self.stdout.write(self.style.SUCCESS("Sin regresiones respecto de la base."))
+
+    def log_case(self, name, metrics):
+        self.stdout.write(
+            f"  {name:<28} {metrics['wall_ms']:>10.1f} ms "
+            f"{metrics['queries']:>6} consultas {metrics['peak_kb']:>9} KB")
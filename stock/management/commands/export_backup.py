@@ -0,0 +1,49 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stock.backup import (
+    buffered, export_checkpoint, gzipped, iter_backup_json, parse_checkpoint,
+)
+
+
+class Command(BaseCommand):
+    help = ("Genera un respaldo completo o incremental (--since) en un archivo. "
+            "Imprime el checkpoint a usar como --since en el siguiente incremental.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Archivo de salida ('-' para stdout).")
+        parser.add_argument(
+            "--since",
+            help="Checkpoint ISO 8601 del respaldo anterior (respaldo incremental).",
+        )
+        parser.add_argument("--gzip", action="store_true",
+                            help="Comprimir la salida con gzip.")
+        parser.add_argument("--chunk-size", type=int, default=2000,
+                            help="Filas leídas por consulta (por defecto 2000).")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            try:
+                since = parse_checkpoint(options["since"])
+            except ValueError as e:
+                raise CommandError(e)
+
+        checkpoint = export_checkpoint()
+        stream = buffered(iter_backup_json(
+            chunk_size=options["chunk_size"], since=since, checkpoint=checkpoint))
+        if options["gzip"]:
+            stream = gzipped(stream)
+
+        if options["output"] == "-":
+            out = sys.stdout.buffer
+            for block in stream:
+                out.write(block)
+            out.flush()
+        else:
+            with open(options["output"], "wb") as out:
+                for block in stream:
+                    out.write(block)
+
+        self.stderr.write(f"checkpoint: {checkpoint.isoformat()}")
@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+
+from stock.apps import setup_worker
+from stock.caching import bump_data_version
+from stock.costing import (
+    correction_movement, ledger_totals, product_chunks, replay_products,
+)
+from stock.ledger import record_movements
+from stock.models import Product
+
+
+def stored_products(product_ids, products=Product.objects):
+    return products.only("name", "stock", "average_cost").in_bulk(list(product_ids))
+
+
+def differing(replayed, stored):
+    """
+    (producto, stock, costo reconstruidos) de los productos cuyo stock o
+    costo guardado (`stored`) difiere de la reconstrucción `replayed`.
+    """
+    return [
+        (stored[product_id], stock, average_cost)
+        for product_id, (stock, average_cost) in replayed.items()
+        if product_id in stored  # Pudo eliminarse entre las dos pasadas
+        and (stored[product_id].stock, stored[product_id].average_cost)
+        != (stock, average_cost)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula el stock y el costo promedio de cada producto "
+        "reproduciendo su historia de compras, ventas y ajustes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="Solo reporta los productos cuyo stock o costo guardado "
+                 "difiere de la reconstrucción, sin modificar nada.",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count() or 1,
+            help="Procesos en paralelo (por defecto, uno por CPU).",
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=500,
+            help="Productos por bloque de trabajo (por defecto 500).",
+        )
+
+    def handle(self, *args, **options):
+        chunks = product_chunks(options["chunk_size"])
+        workers = max(min(options["workers"], len(chunks)), 1)
+
+        if workers > 1:
+            # Cada proceso abre su propia conexión a la base de datos
+            database_name = connections["default"].settings_dict["NAME"]
+            connections.close_all()
+            pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=setup_worker,
+                initargs=(database_name,),
+            )
+            results = pool.map(replay_products, chunks)
+        else:
+            pool = None
+            results = map(replay_products, chunks)
+
+        differences = 0
+        checked = 0
+        try:
+            for replayed in results:
+                checked += len(replayed)
+                stale = differing(replayed, stored_products(replayed))
+                if options["verify"]:
+                    for product, stock, average_cost in stale:
+                        self.report(product, stock, average_cost)
+                    differences += len(stale)
+                elif stale:
+                    differences += self.apply([p.pk for p, _, _ in stale])
+            if differences and not options["verify"]:
+                bump_data_version()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if options["verify"]:
+            message = f"{differences} de {checked} productos difieren."
+            if differences:
+                self.stdout.write(self.style.WARNING(message))
+            else:
+                self.stdout.write(self.style.SUCCESS(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"{differences} de {checked} productos actualizados."))
+
+    def report(self, product, stock, average_cost):
+        self.stdout.write(
+            f"{product.name} (#{product.pk}): "
+            f"stock {product.stock} → {stock}, "
+            f"costo {product.average_cost} → {average_cost}"
+        )
+
+    def apply(self, product_ids):
+        """
+        Corrige los productos en una transacción corta: los bloquea y
+        reproduce otra vez su historia, porque una venta o compra pudo
+        entrar después de la primera pasada (hecha sin bloquear y en
+        paralelo). Devuelve la cantidad de productos corregidos.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            stored = stored_products(product_ids, Product.objects.select_for_update())
+            stale = differing(replay_products(product_ids), stored)
+            changed = []
+            for product, stock, average_cost in stale:
+                self.report(product, stock, average_cost)
+                product.stock = stock
+                product.average_cost = average_cost
+                product.updated_at = now
+                changed.append(product)
+            if changed:
+                Product.objects.bulk_update(
+                    changed, ["stock", "average_cost", "updated_at"])
+                ledger = ledger_totals([p.pk for p in changed])
+                record_movements([
+                    correction_movement(
+                        p.pk, ledger.get(p.pk, (0, Decimal(0))),
+                        p.stock, p.average_cost, now.date())
+                    for p in changed
+                ])
+        return len(changed)
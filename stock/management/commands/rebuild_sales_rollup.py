@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from stock.rollups import rebuild_daily_sales
+
+
+class Command(BaseCommand):
+    help = "Reconstruye desde cero el resumen diario de ventas por producto."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-days", type=int, default=31,
+            help="Días de ventas agregados por consulta (por defecto 31).",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Filas por INSERT en bulk_create (por defecto 1000).",
+        )
+
+    def handle(self, *args, **options):
+        created = rebuild_daily_sales(
+            chunk_days=options["chunk_days"],
+            batch_size=options["batch_size"],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Resumen diario reconstruido: {created} filas."))
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stock.models import Product
+from stock.seeding import clear_stock_data, seed_stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera datos sintéticos (productos, compras, ventas, gastos y otros "
+        "ingresos de varios años) para probar el rendimiento."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sale-lines", type=int, default=100_000,
+            help="Líneas de venta aproximadas a generar (por defecto 100000).",
+        )
+        parser.add_argument(
+            "--products", type=int, default=200,
+            help="Cantidad de productos (por defecto 200).",
+        )
+        parser.add_argument(
+            "--categories", type=int, default=10,
+            help="Cantidad de categorías (por defecto 10).",
+        )
+        parser.add_argument(
+            "--years", type=int, default=3,
+            help="Años de historia hasta hoy (por defecto 3).",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=1,
+            help="Semilla: la misma semilla genera los mismos datos.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=5000,
+            help="Líneas por lote de inserción (por defecto 5000).",
+        )
+        parser.add_argument(
+            "--clear", action="store_true",
+            help="Borra antes todos los datos del negocio existentes.",
+        )
+
+    def handle(self, *args, **options):
+        if min(options["products"], options["categories"], options["years"]) < 1:
+            raise CommandError("--products, --categories y --years deben ser mayores que 0")
+        if Product.objects.exists():
+            if not options["clear"]:
+                raise CommandError(
+                    "La base ya tiene datos; usa --clear para reemplazarlos.")
+            clear_stock_data()
+
+        started = time.monotonic()
+        counts = seed_stock(
+            categories=options["categories"],
+            products=options["products"],
+            years=options["years"],
+            sale_lines=options["sale_lines"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            log=self.stdout.write if options["verbosity"] > 1 else None,
+        )
+        for model, count in counts.items():
+            self.stdout.write(f"{model}: {count}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Datos generados en {time.monotonic() - started:.1f} s."))
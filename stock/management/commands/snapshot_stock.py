@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from stock.ledger import rebuild_ledger, take_monthly_snapshots, take_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Toma instantáneas de stock y valor por producto para acelerar las "
+        "consultas históricas de inventario."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--date",
+            help="Fecha de cierre de la instantánea (YYYY-MM-DD, por defecto hoy).",
+        )
+        parser.add_argument(
+            "--monthly", action="store_true",
+            help="Reemplaza todas las instantáneas por una al cierre de cada "
+                 "mes hasta --date.",
+        )
+        parser.add_argument(
+            "--rebuild-ledger", action="store_true",
+            help="Reconstruye antes el libro de movimientos desde las "
+                 "compras y ventas (implica --monthly).",
+        )
+
+    def handle(self, *args, **options):
+        day = timezone.now().date()
+        if options["date"]:
+            day = parse_date(options["date"])
+            if day is None:
+                raise CommandError(f"Fecha inválida: {options['date']}")
+
+        if options["rebuild_ledger"]:
+            created = rebuild_ledger()
+            self.stdout.write(f"Libro reconstruido: {created} movimientos.")
+        if options["monthly"] or options["rebuild_ledger"]:
+            created = take_monthly_snapshots(day)
+        else:
+            created = take_snapshot(day)
+        self.stdout.write(self.style.SUCCESS(
+            f"Instantáneas guardadas: {created}."))
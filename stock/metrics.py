@@ -0,0 +1,183 @@
+import atexit
+import math
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+# Límites (segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Cada proceso acumula en memoria y escribe al archivo compartido a lo
+# sumo una vez por este intervalo (segundos)
+FLUSH_INTERVAL = 1.0
+
+# Familias de métricas: nombre → (tipo, ayuda)
+FAMILIES = {
+    "mistock_http_requests_total": (
+        "counter", "Peticiones atendidas por vista, método y estado."),
+    "mistock_http_request_duration_seconds": (
+        "histogram", "Duración de las peticiones por vista."),
+    "mistock_db_queries_total": (
+        "counter", "Consultas SQL ejecutadas por vista."),
+    "mistock_db_duration_seconds_total": (
+        "counter", "Tiempo total en SQL por vista."),
+    "mistock_invoice_lines_posted_total": (
+        "counter", "Líneas de factura guardadas desde los formularios de factura."),
+    "mistock_invoice_posting_seconds_total": (
+        "counter", "Tiempo total aplicando facturas (líneas, stock y costos)."),
+    "mistock_dashboard_cache_age_seconds": (
+        "gauge", "Antigüedad del dashboard en caché por ventana de ventas."),
+}
+HISTOGRAM_SUFFIXES = ("_bucket", "_sum", "_count")
+
+_pending = defaultdict(float)  # (nombre, etiquetas) → incremento sin escribir
+_lock = threading.Lock()
+_last_flush = [time.monotonic()]
+
+
+def format_labels(**labels):
+    """Etiquetas en formato Prometheus: `a="1",b="x"` (con escapes)."""
+    return ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items()
+    )
+
+
+def join_labels(*parts):
+    return ",".join(part for part in parts if part)
+
+
+def inc(name, value=1, **labels):
+    """Suma `value` al contador `name` con esas etiquetas."""
+    with _lock:
+        _pending[name, format_labels(**labels)] += value
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Registra `value` en el histograma `name` (buckets acumulativos)."""
+    base = format_labels(**labels)
+    with _lock:
+        for bound in buckets:
+            if value <= bound:
+                _pending[name + "_bucket", join_labels(base, f'le="{bound}"')] += 1
+        _pending[name + "_bucket", join_labels(base, 'le="+Inf"')] += 1
+        _pending[name + "_sum", base] += value
+        _pending[name + "_count", base] += 1
+
+
+def record_posting(kind, lines, seconds):
+    """Cuenta las líneas de una factura aplicada (`kind`: purchase/sale)."""
+    if not settings.METRICS:
+        return
+    inc("mistock_invoice_lines_posted_total", lines, kind=kind)
+    inc("mistock_invoice_posting_seconds_total", seconds, kind=kind)
+    flush()
+
+
+def connect():
+    db = sqlite3.connect(settings.METRICS_DB, timeout=5)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS metrics ("
+        " name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL,"
+        " PRIMARY KEY (name, labels))"
+    )
+    return db
+
+
+def flush(force=False):
+    """
+    Escribe lo acumulado por este proceso en el archivo compartido
+    (METRICS_DB), sumándolo a lo que escribieron los demás procesos.
+    Sin `force` solo escribe si pasó FLUSH_INTERVAL desde la última vez:
+    MetricsMiddleware lo llama al terminar cada petición y, al salir el
+    proceso, un `atexit` escribe lo que quede pendiente.
+    Si la escritura falla, los incrementos quedan para la siguiente.
+    """
+    with _lock:
+        if not _pending or (
+                not force and time.monotonic() - _last_flush[0] < FLUSH_INTERVAL):
+            return
+        rows = [(name, labels, value) for (name, labels), value in _pending.items()]
+        _pending.clear()
+        _last_flush[0] = time.monotonic()
+    try:
+        db = connect()
+        try:
+            with db:
+                db.executemany(
+                    "INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                    rows,
+                )
+        finally:
+            db.close()
+    except sqlite3.Error:
+        with _lock:
+            for name, labels, value in rows:
+                _pending[name, labels] += value
+
+
+# Lo acumulado desde la última escritura no se pierde al reiniciar workers
+atexit.register(flush, force=True)
+
+
+def family_of(name):
+    if name in FAMILIES:
+        return name
+    for suffix in HISTOGRAM_SUFFIXES:
+        if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+            return name[:-len(suffix)]
+    return name
+
+
+def sample_order(family, name, labels):
+    """
+    Orden de las muestras de una familia: por etiquetas y, en los
+    histogramas, buckets por límite numérico seguidos de _sum y _count.
+    """
+    suffix = name[len(family):]
+    if suffix != "_bucket":
+        return labels, HISTOGRAM_SUFFIXES.index(suffix) if suffix else 0, 0
+    base, _, bound = labels.rpartition('le="')
+    bound = bound.rstrip('"')
+    return base.rstrip(","), 0, math.inf if bound == "+Inf" else float(bound)
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_metrics(gauges=()):
+    """
+    Texto en formato de exposición de Prometheus con lo acumulado por todos
+    los procesos más `gauges` [(nombre, etiquetas, valor)] calculados al
+    momento de la consulta.
+    """
+    flush(force=True)
+    db = connect()
+    try:
+        rows = db.execute("SELECT name, labels, value FROM metrics").fetchall()
+    finally:
+        db.close()
+    rows += [(name, format_labels(**labels), value) for name, labels, value in gauges]
+
+    families = defaultdict(list)
+    for name, labels, value in rows:
+        families[family_of(name)].append((name, labels, value))
+
+    lines = []
+    for family in sorted(families):
+        kind, help_text = FAMILIES.get(family, ("untyped", ""))
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        samples = sorted(families[family],
+                         key=lambda row: sample_order(family, row[0], row[1]))
+        for name, labels, value in samples:
+            series = f"{name}{{{labels}}}" if labels else name
+            lines.append(f"{series} {format_value(value)}")
+    return "\n".join(lines) + "\n"
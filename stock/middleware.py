@@ -0,0 +1,249 @@
+import cProfile
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.backends.django import Template
+
+from . import metrics
+from .profiling import StackSampler, save_capture
+
+logger = logging.getLogger("stock.timing")
+
+# Medición de la petición en curso en este hilo (None si no se mide)
+_current = threading.local()
+
+
+class RequestTiming:
+    """Acumula los tiempos de una petición."""
+
+    def __init__(self, slow_queries):
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+        # SQL ejecutado mientras se renderizaba una plantilla (consultas
+        # perezosas): se descuenta del tiempo propio de la plantilla
+        self.template_sql = 0.0
+        self.rendering = 0
+        self.slowest = []
+        self.slow_queries = slow_queries
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.sql += duration
+        if self.rendering:
+            self.template_sql += duration
+        item = (duration, self.queries, sql)
+        if len(self.slowest) < self.slow_queries:
+            heapq.heappush(self.slowest, item)
+        elif self.slow_queries:
+            heapq.heappushpop(self.slowest, item)
+
+
+def record_query(execute, sql, params, many, context):
+    timing = getattr(_current, "timing", None)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if timing is not None:
+            timing.add_query(sql, time.perf_counter() - started)
+
+
+@contextmanager
+def timed_queries(timing):
+    """
+    Mide en `timing` las consultas de todas las conexiones mientras dura el
+    bloque. Si otro middleware ya está midiendo, se reutiliza su medición y
+    el llamador compara los valores antes y después.
+    """
+    if getattr(_current, "timing", None) is not None:
+        yield _current.timing
+        return
+    _current.timing = timing
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(record_query))
+            yield timing
+    finally:
+        _current.timing = None
+
+
+def install_template_timer():
+    """Envuelve el render de las plantillas de Django (una sola vez)."""
+    if getattr(Template.render, "timed", False):
+        return
+    render = Template.render
+
+    def timed_render(self, context=None, request=None):
+        timing = getattr(_current, "timing", None)
+        if timing is None or timing.rendering:
+            # Sin medición, o plantilla anidada: ya cuenta la de afuera
+            return render(self, context, request)
+        timing.rendering += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            timing.template += time.perf_counter() - started
+            timing.rendering -= 1
+
+    timed_render.timed = True
+    Template.render = timed_render
+
+
+def install_log_handler(path):
+    if logger.handlers:
+        return  # Configurado desde LOGGING
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handler = RotatingFileHandler(path, maxBytes=5 * 1024 * 1024,
+                                  backupCount=3, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class RequestTimingMiddleware:
+    """
+    Mide por petición la cantidad de consultas, el tiempo en SQL, las
+    consultas más lentas, el render de plantillas y el resto (Python de la
+    vista). Lo expone en la cabecera Server-Timing y agrega una línea JSON
+    al log rotativo REQUEST_TIMING_LOG.
+
+    Solo se activa con REQUEST_TIMING = True; si no, Django la quita de la
+    cadena de middleware al iniciar y no tiene costo.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_template_timer()
+        install_log_handler(settings.REQUEST_TIMING_LOG)
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with timed_queries(RequestTiming(settings.REQUEST_TIMING_SLOW_QUERIES)) as timing:
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+
+        template = max(timing.template - timing.template_sql, 0)
+        app = max(total - timing.sql - template, 0)
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={timing.sql * 1000:.1f};desc="{timing.queries} consultas"',
+            f"tpl;dur={template * 1000:.1f}",
+            f"app;dur={app * 1000:.1f}",
+            f"total;dur={total * 1000:.1f}",
+        ])
+        logger.info(json.dumps({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": round(total * 1000, 1),
+            "db_ms": round(timing.sql * 1000, 1),
+            "queries": timing.queries,
+            "template_ms": round(template * 1000, 1),
+            "app_ms": round(app * 1000, 1),
+            "slowest": [
+                {"ms": round(duration * 1000, 1), "sql": sql[:300]}
+                for duration, _, sql in sorted(timing.slowest, reverse=True)
+            ],
+        }, ensure_ascii=False))
+        return response
+
+
+# cProfile no admite dos perfiles activos a la vez en el proceso
+_profile_lock = threading.Lock()
+
+
+class ProfilingMiddleware:
+    """
+    Perfila con cProfile (y muestreo de pilas para el flamegraph) las
+    peticiones de usuarios staff que lo pidan con `?profile=1` o la
+    cabecera `X-Profile: 1`. Las descargas por partes se generan después
+    de la vista y no entran en el perfil. Guarda la captura en
+    PROFILE_DIR (ver stock/profiling.py) y devuelve su nombre en la
+    cabecera X-Profile-Capture. Si ya hay otra captura en curso, la
+    petición se atiende sin perfilar.
+
+    Va después de AuthenticationMiddleware. Con REQUEST_PROFILING = False
+    Django la quita de la cadena al iniciar.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        wanted = (request.GET.get("profile") == "1"
+                  or request.headers.get("X-Profile") == "1")
+        if not (wanted and request.user.is_staff):
+            return self.get_response(request)
+        if not _profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            with StackSampler(threading.get_ident()) as sampler:
+                started = time.perf_counter()
+                response = profiler.runcall(self.get_response, request)
+                duration = time.perf_counter() - started
+        finally:
+            _profile_lock.release()
+
+        name = save_capture(profiler, sampler, settings.PROFILE_DIR, {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "user": request.user.get_username(),
+            "total_ms": round(duration * 1000, 1),
+        }, keep=settings.PROFILE_KEEP)
+        response["X-Profile-Capture"] = name
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Acumula por vista la cantidad de peticiones por estado, el histograma
+    de duración y el tiempo y cantidad de consultas SQL, para /metrics
+    (ver stock/metrics.py). Las vistas se identifican por el nombre de la
+    URL (o su patrón), no por la ruta, para no crear una serie por cada id.
+
+    Solo se activa con METRICS = True.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        with timed_queries(RequestTiming(0)) as timing:
+            queries, sql = timing.queries, timing.sql
+            response = self.get_response(request)
+            queries, sql = timing.queries - queries, timing.sql - sql
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = (match.url_name or match.route) if match else "unmatched"
+        metrics.inc("mistock_http_requests_total", view=view,
+                    method=request.method, status=response.status_code)
+        metrics.observe("mistock_http_request_duration_seconds", duration, view=view)
+        metrics.inc("mistock_db_queries_total", queries, view=view)
+        metrics.inc("mistock_db_duration_seconds_total", sql, view=view)
+        metrics.flush()
+        return response
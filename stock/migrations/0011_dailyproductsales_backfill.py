@@ -0,0 +1,49 @@
+from django.db import migrations
+from django.db.models import Count, F, Sum
+
+
+def backfill_daily_sales(apps, schema_editor):
+    Sale = apps.get_model("stock", "Sale")
+    DailyProductSales = apps.get_model("stock", "DailyProductSales")
+
+    grouped = (
+        Sale.objects.order_by()
+        .values("invoice__date", "product_id", "product__category_id")
+        .annotate(
+            lines=Count("pk"),
+            qty=Sum("quantity"),
+            revenue=Sum(F("quantity") * F("price")),
+            cost=Sum(F("quantity") * F("cost")),
+        )
+    )
+    DailyProductSales.objects.bulk_create(
+        [
+            DailyProductSales(
+                date=row["invoice__date"],
+                product_id=row["product_id"],
+                category_id=row["product__category_id"],
+                lines=row["lines"],
+                quantity=row["qty"],
+                revenue=row["revenue"],
+                cost=row["cost"],
+            )
+            for row in grouped.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+def clear_daily_sales(apps, schema_editor):
+    DailyProductSales = apps.get_model("stock", "DailyProductSales")
+    DailyProductSales.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0010_dailyproductsales"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_sales, clear_daily_sales),
+    ]
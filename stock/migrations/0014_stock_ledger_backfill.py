@@ -0,0 +1,59 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def backfill_movements(apps, schema_editor):
+    Product = apps.get_model("stock", "Product")
+    Purchase = apps.get_model("stock", "Purchase")
+    Sale = apps.get_model("stock", "Sale")
+    StockMovement = apps.get_model("stock", "StockMovement")
+
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    batch = []
+    for model, kind, sign, source in ((Purchase, "purchase", 1, "purchase_id"),
+                                      (Sale, "sale", -1, "sale_id")):
+        lines = model.objects.select_related("invoice").order_by(
+            "invoice__date", "created_at", "pk")
+        for line in lines.iterator(chunk_size=2000):
+            quantity = sign * line.quantity
+            value = quantity * line.cost
+            totals[line.product_id][0] += quantity
+            totals[line.product_id][1] += value
+            batch.append(StockMovement(
+                created_at=line.created_at, date=line.invoice.date,
+                product_id=line.product_id, kind=kind, quantity=quantity,
+                unit_cost=line.cost, value=value, **{source: line.pk},
+            ))
+
+    # Ajuste que cuadra el libro con el stock y costo actuales de cada producto
+    today = timezone.now().date()
+    for product in Product.objects.only("stock", "average_cost").iterator():
+        quantity, value = totals.get(product.pk, (0, 0))
+        target = Decimal(product.stock * product.average_cost).quantize(
+            Decimal("0.01"))
+        if product.stock != quantity or target != value:
+            batch.append(StockMovement(
+                date=today, product_id=product.pk, kind="adjustment",
+                quantity=product.stock - quantity,
+                unit_cost=product.average_cost, value=target - value,
+            ))
+    StockMovement.objects.bulk_create(batch, batch_size=1000)
+
+
+def clear_movements(apps, schema_editor):
+    apps.get_model("stock", "StockSnapshot").objects.all().delete()
+    apps.get_model("stock", "StockMovement").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0013_stock_ledger"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_movements, clear_movements),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:18
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_invoice_dates(apps, schema_editor):
+    for line_name, invoice_name in (("Purchase", "PurchaseInvoice"),
+                                    ("Sale", "SaleInvoice")):
+        Line = apps.get_model("stock", line_name)
+        Invoice = apps.get_model("stock", invoice_name)
+        Line.objects.update(date=Subquery(
+            Invoice.objects.filter(pk=OuterRef("invoice_id")).values("date")[:1]
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0014_stock_ledger_backfill'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='date',
+            field=models.DateField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='date',
+            field=models.DateField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(copy_invoice_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['date', 'category'], name='stock_expen_date_cf87cb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='otherincome',
+            index=models.Index(fields=['date', 'category'], name='stock_other_date_90fb8b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['date', 'product'], name='stock_purch_date_fb5b9b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['product', 'date'], name='stock_purch_product_8bfefc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseinvoice',
+            index=models.Index(fields=['date'], name='stock_purch_date_9f42e0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['date', 'product'], name='stock_sale_date_bff482_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['product', 'date'], name='stock_sale_product_9afd51_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saleinvoice',
+            index=models.Index(fields=['date'], name='stock_salei_date_394840_idx'),
+        ),
+    ]
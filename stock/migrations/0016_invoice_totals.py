@@ -0,0 +1,75 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:21
+
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import migrations, models
+
+
+def backfill_invoice_totals(apps, schema_editor):
+    for invoice_name, line_name, amount in (
+            ("PurchaseInvoice", "Purchase", "cost"),
+            ("SaleInvoice", "Sale", "price")):
+        Invoice = apps.get_model("stock", invoice_name)
+        Line = apps.get_model("stock", line_name)
+        lines = (
+            Line.objects.order_by("invoice_id", "created_at", "pk")
+            .values_list("invoice_id", "quantity", amount, "product__name")
+        )
+        batch = []
+        for invoice_id, rows in groupby(lines.iterator(chunk_size=5000),
+                                        key=itemgetter(0)):
+            rows = list(rows)
+            batch.append(Invoice(
+                pk=invoice_id,
+                total=sum((q * value for _, q, value, _ in rows), Decimal(0)),
+                item_count=len(rows),
+                items_summary=", ".join(f"{q} × {name}" for _, q, _, name in rows),
+            ))
+            if len(batch) >= 1000:
+                Invoice.objects.bulk_update(
+                    batch, ["total", "item_count", "items_summary"])
+                batch = []
+        Invoice.objects.bulk_update(batch, ["total", "item_count", "items_summary"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0015_line_dates_and_report_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseinvoice',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='purchaseinvoice',
+            name='items_summary',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='purchaseinvoice',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='saleinvoice',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='saleinvoice',
+            name='items_summary',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='saleinvoice',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14),
+        ),
+        migrations.RunPython(backfill_invoice_totals, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -11,6 +12,7 @@ class Category(models.Model):
 
 class ExpenseCategory(models.Model):
     name = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['name']
@@ -28,6 +30,7 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     average_cost = models.DecimalField(
         max_digits=10, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def update_average_cost(self, added_quantity, added_cost):
         total_cost = (self.stock * self.average_cost) + \
@@ -35,6 +38,43 @@ class Product(models.Model):
         total_quantity = self.stock + added_quantity
         self.average_cost = total_cost / total_quantity
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores cargados, para saber al guardar qué cambió
+        instance._loaded = {name: instance.__dict__.get(name)
+                            for name in ("name", "category_id")}
+        return instance
+
+    def will_change(self, field, update_fields):
+        """Si `save(update_fields=...)` va a escribir un `field` distinto del cargado."""
+        if self._state.adding:
+            return False
+        attname = self._meta.get_field(field).attname
+        if update_fields is not None and not {field, attname} & set(update_fields):
+            return False
+        loaded = getattr(self, "_loaded", None)
+        return loaded is None or getattr(self, attname) != loaded.get(attname)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        renamed = self.will_change("name", update_fields)
+        recategorized = self.will_change("category", update_fields)
+        super().save(*args, **kwargs)
+        self._loaded = {"name": self.name, "category_id": self.category_id}
+        if recategorized:
+            # Mantener la categoría del resumen diario alineada con el producto
+            DailyProductSales.objects.filter(product=self).exclude(
+                category_id=self.category_id
+            ).update(category_id=self.category_id)
+        if renamed:
+            # El resumen guardado de las facturas ("2 × Arroz") lleva el nombre
+            from .rollups import refresh_invoice_totals
+            for invoice_model, line_model in ((PurchaseInvoice, Purchase),
+                                              (SaleInvoice, Sale)):
+                refresh_invoice_totals(invoice_model, line_model.objects.filter(
+                    product=self).values_list("invoice_id", flat=True).distinct())
+
     def __str__(self):
         return self.name
 
@@ -48,6 +88,7 @@ class ProductImage(models.Model):
     )
     image = models.ImageField(upload_to="product_images/")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['-created_at']
@@ -56,23 +97,54 @@ class ProductImage(models.Model):
         return f"Imagen de {self.product}"
 
 
+def line_invoices(old, new):
+    """Facturas afectadas al guardar una línea (puede cambiar de factura)."""
+    ids = [new.invoice_id]
+    if old is not None and old.invoice_id != new.invoice_id:
+        ids.append(old.invoice_id)
+    return ids
+
+
 class PurchaseInvoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     date = models.DateField(default=timezone.now)
     supplier = models.CharField(max_length=200, default="Aliexpress")
+    # Totales de las líneas guardados para los listados y el detalle;
+    # se actualizan con rollups.refresh_invoice_totals al guardar líneas
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0,
+                                editable=False)
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    items_summary = models.TextField(blank=True, default="", editable=False)
 
     def get_total(self):
-        return sum(item.get_total() for item in self.items.all())
+        return self.total
+
+    def save(self, *args, **kwargs):
+        old_date = None
+        if self.pk and not self._state.adding:
+            old_date = PurchaseInvoice.objects.filter(
+                pk=self.pk).values_list("date", flat=True).first()
+        super().save(*args, **kwargs)
+        if old_date is not None and old_date != self.date:
+            self.items.update(date=self.date, updated_at=timezone.now())
+            # Mover los movimientos de las líneas existentes al nuevo día
+            from .costing import invoice_changes, recompute_costs
+            from .ledger import move_invoice_movements
+            move_invoice_movements(self, old_date, self.date)
+            recompute_costs(invoice_changes(self, old_date))
 
     def __str__(self):
         return f"Purchase Invoice #{self.id} - {self.supplier}"
 
     class Meta:
         ordering = ['-date']
+        indexes = [models.Index(fields=["date"])]
 
 
 class Purchase(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     invoice = models.ForeignKey(
         PurchaseInvoice, on_delete=models.CASCADE,
         related_name="items",
@@ -80,63 +152,45 @@ class Purchase(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Copia de invoice.date para filtrar reportes sin unir con la factura
+    date = models.DateField(default=timezone.now, editable=False)
 
     def get_total(self):
         return self.quantity * self.cost
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=["date", "product"]),
+            models.Index(fields=["product", "date"]),
+        ]
 
     def save(self, *args, **kwargs):
-        if self.pk and not self._state.adding:
-            old = Purchase.objects.get(pk=self.pk)
-            if old.product_id == self.product_id and old.quantity == self.quantity \
-                    and old.cost == self.cost:
-                super().save(*args, **kwargs)
-                return
-            # Revertir el efecto en el producto viejo
-            old_prod = old.product
-            if old_prod.stock - old.quantity > 0:
-                old_prod.average_cost = (
-                    (old_prod.stock * old_prod.average_cost
-                     - old.quantity * old.cost) / (old_prod.stock - old.quantity)
-                )
-            else:
-                old_prod.average_cost = 0
-            old_prod.stock -= old.quantity
-            old_prod.save()
-            # Si el producto cambió, descuento la nueva cantidad debe ir al nuevo
-            if old.product_id != self.product_id:
-                new_prod = self.product
-                new_prod.update_average_cost(self.quantity, self.cost)
-                new_prod.stock += self.quantity
-                new_prod.save()
-            else:
-                # Mismo producto: aplicar delta sobre old_prod ya revertido
-                old_prod.update_average_cost(self.quantity, self.cost)
-                old_prod.stock += self.quantity
-                old_prod.save()
-                self.product = old_prod
-
-        else:
-            self.product.update_average_cost(self.quantity, self.cost)
-            self.product.stock += self.quantity
-            self.product.save()
-        super().save(*args, **kwargs)
+        from .costing import line_changes, recompute_costs
+        from .ledger import record_line_change
+        from .posting import post_purchase_line
+        from .rollups import refresh_invoice_totals
+        self.date = self.invoice.date
+        with transaction.atomic():
+            old = post_purchase_line(self)
+            super().save(*args, **kwargs)
+            record_line_change(old, self)
+            recompute_costs(line_changes(old, self))
+            refresh_invoice_totals(PurchaseInvoice, line_invoices(old, self))
 
     def delete(self, *args, **kwargs):
-        product = self.product
-        if product.stock - self.quantity > 0:
-            # Revert average cost
-            total_value = (product.stock * product.average_cost) - \
-                (self.quantity * self.cost)
-            new_quantity = product.stock - self.quantity
-            product.average_cost = total_value / new_quantity
-        else:
-            product.average_cost = 0
-        product.stock -= self.quantity
-        self.product.save()
-        super().delete(*args, **kwargs)
+        from .costing import line_changes, recompute_costs
+        from .ledger import record_line_change
+        from .posting import unpost_purchase_line
+        from .rollups import refresh_invoice_totals
+        with transaction.atomic():
+            unpost_purchase_line(self)
+            record_line_change(self, None)
+            changes = line_changes(self, None)
+            result = super().delete(*args, **kwargs)
+            recompute_costs(changes)
+            refresh_invoice_totals(PurchaseInvoice, [self.invoice_id])
+            return result
 
     def __str__(self):
         return f"Purchase #{self.id} - {self.quantity} x {self.product}"
@@ -144,21 +198,47 @@ class Purchase(models.Model):
 
 class SaleInvoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     date = models.DateField(default=timezone.now)
     customer = models.CharField(max_length=200, default="Generic")
+    # Totales de las líneas guardados para los listados y el detalle;
+    # se actualizan con rollups.refresh_invoice_totals al guardar líneas
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0,
+                                editable=False)
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    items_summary = models.TextField(blank=True, default="", editable=False)
 
     def get_total(self):
-        return sum(item.get_total() for item in self.items.all())
+        return self.total
+
+    def save(self, *args, **kwargs):
+        old_date = None
+        if self.pk and not self._state.adding:
+            old_date = SaleInvoice.objects.filter(
+                pk=self.pk).values_list("date", flat=True).first()
+        super().save(*args, **kwargs)
+        if old_date is not None and old_date != self.date:
+            self.items.update(date=self.date, updated_at=timezone.now())
+            # Mover las líneas existentes al nuevo día en el resumen diario
+            # y en el libro de movimientos
+            from .costing import invoice_changes, recompute_costs
+            from .ledger import move_invoice_movements
+            from .rollups import move_invoice_sales
+            move_invoice_sales(self, old_date, self.date)
+            move_invoice_movements(self, old_date, self.date)
+            recompute_costs(invoice_changes(self, old_date))
 
     def __str__(self):
         return f"Sale Invoice #{self.id} - {self.customer}"
 
     class Meta:
         ordering = ['-date']
+        indexes = [models.Index(fields=["date"])]
 
 
 class Sale(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     invoice = models.ForeignKey(
         SaleInvoice, on_delete=models.CASCADE,
         related_name="items",
@@ -167,48 +247,47 @@ class Sale(models.Model):
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     cost = models.DecimalField(max_digits=10, decimal_places=2)
+    # Copia de invoice.date para filtrar reportes sin unir con la factura
+    date = models.DateField(default=timezone.now, editable=False)
 
     def get_total(self):
         return self.quantity * self.price
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=["date", "product"]),
+            models.Index(fields=["product", "date"]),
+        ]
 
     def save(self, *args, **kwargs):
-        if self.pk:
-            old = Sale.objects.get(pk=self.pk)
-            if old.product_id == self.product_id and old.quantity == self.quantity:
-                super().save(*args, **kwargs)
-                return
-            # Revertir el efecto en el producto viejo
-            old_prod = old.product
-            if old.product_id != self.product_id:
-                old_prod.stock += old.quantity
-                old_prod.save()
-                # Descontar del nuevo producto
-                new_prod = self.product
-                new_prod.stock -= self.quantity
-                new_prod.save()
-                self.price = new_prod.price
-                self.cost = new_prod.average_cost
-            else:
-                # Mismo producto: aplicar delta neto sobre stock
-                old_prod.stock += old.quantity - self.quantity
-                old_prod.save()
-                self.price = old_prod.price
-                self.cost = old_prod.average_cost
-                self.product = old_prod
-        else:
-            self.product.stock -= self.quantity
-            self.price = self.product.price
-            self.cost = self.product.average_cost
-            self.product.save()
-        super().save(*args, **kwargs)
+        from .costing import line_changes, recompute_costs
+        from .ledger import record_line_change
+        from .posting import post_sale_line
+        from .rollups import record_sale_change, refresh_invoice_totals
+        self.date = self.invoice.date
+        with transaction.atomic():
+            old = post_sale_line(self)
+            super().save(*args, **kwargs)
+            record_sale_change(old, self)
+            record_line_change(old, self)
+            recompute_costs(line_changes(old, self))
+            refresh_invoice_totals(SaleInvoice, line_invoices(old, self))
 
     def delete(self, *args, **kwargs):
-        self.product.stock += self.quantity
-        self.product.save()
-        super().delete(*args, **kwargs)
+        from .costing import line_changes, recompute_costs
+        from .ledger import record_line_change
+        from .posting import unpost_sale_line
+        from .rollups import refresh_invoice_totals
+        with transaction.atomic():
+            # El resumen diario se descuenta en la señal pre_delete
+            unpost_sale_line(self)
+            record_line_change(self, None)
+            changes = line_changes(self, None)
+            result = super().delete(*args, **kwargs)
+            recompute_costs(changes)
+            refresh_invoice_totals(SaleInvoice, [self.invoice_id])
+            return result
 
     def __str__(self):
         return f"Sale #{self.id} - {self.quantity} x {self.product}"
@@ -216,6 +295,7 @@ class Sale(models.Model):
 
 class Expense(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     date = models.DateField(default=timezone.now)
     category = models.ForeignKey(
         ExpenseCategory, on_delete=models.SET_NULL,
@@ -234,10 +314,12 @@ class Expense(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=["date", "category"])]
 
 
 class OtherIncomeCategory(models.Model):
     name = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['name']
@@ -248,6 +330,7 @@ class OtherIncomeCategory(models.Model):
 
 class OtherIncome(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     date = models.DateField(default=timezone.now)
     category = models.ForeignKey(
         OtherIncomeCategory, on_delete=models.SET_NULL,
@@ -265,4 +348,121 @@ class OtherIncome(models.Model):
         return f"C$ {self.amount} - {self.description}"
 
     class Meta:
-        ordering = ['-date', '-created_at']
\ No newline at end of file
+        ordering = ['-date', '-created_at']
+        indexes = [models.Index(fields=["date", "category"])]
+
+
+class DailyProductSales(models.Model):
+    """
+    Resumen diario de ventas por producto. Se mantiene con deltas desde
+    Sale.save/Sale.delete y SaleInvoice.save; se reconstruye con
+    `manage.py rebuild_sales_rollup`.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="daily_sales",
+    )
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    lines = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "product"], name="unique_daily_product_sales",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.quantity} x {self.product}"
+
+
+class DeletedRecord(models.Model):
+    """
+    Registro de eliminaciones para los respaldos incrementales: permite
+    aplicar en la restauración los borrados ocurridos después del último respaldo.
+    """
+    model_name = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ['deleted_at']
+
+    def __str__(self):
+        return f"{self.model_name} #{self.object_id} eliminado"
+
+
+class StockMovement(models.Model):
+    """
+    Libro de movimientos de inventario. Solo se agregan filas: modificar o
+    eliminar una línea de compra o venta escribe su reverso y, si aplica,
+    el movimiento nuevo. `value` es el efecto firmado en el valor del
+    inventario (cantidad × costo unitario, o solo valor en revalorizaciones).
+    """
+    PURCHASE = "purchase"
+    SALE = "sale"
+    ADJUSTMENT = "adjustment"
+    REVALUATION = "revaluation"
+    KIND_CHOICES = [
+        (PURCHASE, "Compra"),
+        (SALE, "Venta"),
+        (ADJUSTMENT, "Ajuste"),
+        (REVALUATION, "Revalorización"),
+    ]
+
+    created_at = models.DateTimeField(default=timezone.now)
+    date = models.DateField()
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="movements",
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField(default=0)
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    purchase = models.ForeignKey(
+        Purchase, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name="movements",
+    )
+    sale = models.ForeignKey(
+        Sale, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name="movements",
+    )
+
+    class Meta:
+        ordering = ['date', 'created_at', 'id']
+        indexes = [
+            models.Index(fields=["product", "date"]),
+            models.Index(fields=["date"]),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.get_kind_display()} {self.quantity:+} x {self.product}"
+
+
+class StockSnapshot(models.Model):
+    """
+    Stock y valor de un producto al cierre de `date`. Las consultas
+    históricas parten de la última instantánea y suman solo los
+    movimientos posteriores. Se toman con `manage.py snapshot_stock`.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="snapshots",
+    )
+    stock = models.IntegerField(default=0)
+    value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "date"], name="unique_stock_snapshot",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.stock} x {self.product}"
@@ -0,0 +1,55 @@
+from django.db.models import Count, Q, Sum
+
+
+def period_filter(date_field, start=None, end=None):
+    """
+    Construye el Q de un período sobre `date_field`.
+    `start` es inclusivo y `end` exclusivo; cualquiera puede ser None.
+    """
+    q = Q()
+    if start is not None:
+        q &= Q(**{f"{date_field}__gte": start})
+    if end is not None:
+        q &= Q(**{f"{date_field}__lt": end})
+    return q
+
+
+def period_totals(queryset, date_field, periods, sums=None, counts=()):
+    """
+    Calcula en una sola consulta los totales de varios períodos.
+
+    `periods` es un dict nombre → (inicio, fin) y `sums` un dict
+    métrica → expresión. Devuelve un dict métrica → {período: total}
+    con los nulos convertidos a 0. Las métricas en `counts` cuentan filas.
+
+        period_totals(Sale.objects, "date",
+                      {"today": (hoy, None)},
+                      sums={"income": F("quantity") * F("price")},
+                      counts=["sales"])
+        → {"income": {"today": ...}, "sales": {"today": ...}}
+    """
+    sums = sums or {}
+    aggregates = {}
+    for period, (start, end) in periods.items():
+        condition = period_filter(date_field, start, end)
+        for metric, expression in sums.items():
+            aggregates[f"{metric}__{period}"] = Sum(expression, filter=condition)
+        for metric in counts:
+            aggregates[f"{metric}__{period}"] = Count("pk", filter=condition)
+
+    # Acotar al rango que cubren todos los períodos permite recorrer solo
+    # esa parte del índice de fecha en vez de la tabla completa
+    starts = [start for start, _end in periods.values()]
+    ends = [end for _start, end in periods.values()]
+    if periods and None not in starts:
+        queryset = queryset.filter(**{f"{date_field}__gte": min(starts)})
+    if periods and None not in ends:
+        queryset = queryset.filter(**{f"{date_field}__lt": max(ends)})
+
+    row = queryset.aggregate(**aggregates) if aggregates else {}
+
+    result = {metric: {} for metric in list(sums) + list(counts)}
+    for key, value in row.items():
+        metric, period = key.split("__", 1)
+        result[metric][period] = value or 0
+    return result
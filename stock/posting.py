@@ -0,0 +1,285 @@
+import time
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .caching import bump_data_version
+from .costing import add_change, recompute_costs
+from .ledger import CENT, line_movement, movement_date, record_movements
+from .metrics import record_posting
+from .models import Product, Purchase, PurchaseInvoice, Sale, SaleInvoice
+from .rollups import record_sale_changes, refresh_invoice_totals
+
+
+def lock_product(product_id, stock_delta=0):
+    """
+    Aplica `stock_delta` al producto con un UPDATE atómico (F("stock")) y
+    devuelve sus valores ya actualizados.
+
+    El UPDATE va primero a propósito: bloquea la fila en PostgreSQL y toma
+    el lock de escritura en SQLite antes de leer, así dos cajeros que
+    venden el mismo producto no pierden actualizaciones.
+    """
+    Product.objects.filter(pk=product_id).update(
+        stock=F("stock") + stock_delta,
+        updated_at=timezone.now(),
+    )
+    return (
+        Product.objects.select_for_update()
+        .values("stock", "average_cost", "price")
+        .get(pk=product_id)
+    )
+
+
+def set_average_cost(product_id, current, average_cost):
+    if average_cost != current["average_cost"]:
+        Product.objects.filter(pk=product_id).update(average_cost=average_cost)
+
+
+def add_purchase(product_id, quantity, cost):
+    """Suma una compra al stock y recalcula el costo promedio ponderado."""
+    current = lock_product(product_id, quantity)
+    previous_stock = current["stock"] - quantity
+    if current["stock"] > 0:
+        average_cost = (
+            previous_stock * current["average_cost"] + quantity * cost
+        ) / current["stock"]
+    else:
+        average_cost = Decimal(cost)
+    set_average_cost(product_id, current, average_cost)
+
+
+def revert_purchase(product_id, quantity, cost):
+    """Descuenta una compra del stock y revierte su efecto en el costo promedio."""
+    current = lock_product(product_id, -quantity)
+    previous_stock = current["stock"] + quantity
+    if current["stock"] > 0:
+        average_cost = (
+            previous_stock * current["average_cost"] - quantity * cost
+        ) / current["stock"]
+    else:
+        average_cost = Decimal(0)
+    set_average_cost(product_id, current, average_cost)
+
+
+def post_purchase_line(purchase):
+    """
+    Aplica al stock una línea de compra nueva o modificada, antes de
+    guardarla. Devuelve la versión anterior de la línea (o None).
+    Debe llamarse dentro de una transacción.
+    """
+    old = None
+    if purchase.pk and not purchase._state.adding:
+        old = Purchase.objects.select_related("invoice").get(pk=purchase.pk)
+        if old.product_id == purchase.product_id \
+                and old.quantity == purchase.quantity and old.cost == purchase.cost:
+            return old
+        revert_purchase(old.product_id, old.quantity, old.cost)
+    add_purchase(purchase.product_id, purchase.quantity, purchase.cost)
+    return old
+
+
+def unpost_purchase_line(purchase):
+    """Revierte el efecto de una línea de compra que se va a eliminar."""
+    revert_purchase(purchase.product_id, purchase.quantity, purchase.cost)
+
+
+def post_sale_line(sale):
+    """
+    Descuenta del stock una línea de venta nueva o modificada y fija su
+    precio y costo con los valores actuales del producto, antes de
+    guardarla. Devuelve la versión anterior de la línea (o None).
+    Debe llamarse dentro de una transacción.
+    """
+    old = None
+    if sale.pk and not sale._state.adding:
+        old = Sale.objects.select_related("invoice").get(pk=sale.pk)
+        if old.product_id == sale.product_id and old.quantity == sale.quantity:
+            return old
+
+    if old is not None and old.product_id == sale.product_id:
+        # Mismo producto: aplicar solo el delta neto sobre el stock
+        current = lock_product(sale.product_id, old.quantity - sale.quantity)
+    else:
+        if old is not None:
+            lock_product(old.product_id, old.quantity)
+        current = lock_product(sale.product_id, -sale.quantity)
+    sale.price = current["price"]
+    sale.cost = current["average_cost"]
+    return old
+
+
+def unpost_sale_line(sale):
+    """Devuelve al stock las unidades de una línea de venta que se va a eliminar."""
+    lock_product(sale.product_id, sale.quantity)
+
+
+# ===== Facturas completas =====
+
+def formset_changes(formset):
+    """
+    Separa las líneas de un formset ya validado en (nuevas, modificadas,
+    eliminadas) sin guardar nada todavía.
+    """
+    formset.save(commit=False)
+    changed = [obj for obj, _fields in formset.changed_objects]
+    return formset.new_objects, changed, formset.deleted_objects
+
+
+def lock_products(product_ids):
+    """
+    Bloquea los productos de una factura y los devuelve en un dict por id.
+    Igual que `lock_product`, escribe antes de leer para tomar el lock.
+    """
+    Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+    return Product.objects.select_for_update().only(
+        "stock", "average_cost", "price", "updated_at",
+    ).in_bulk(product_ids)
+
+
+def save_lines(model, new, changed, deleted, previous, fields):
+    """
+    Guarda las líneas de la factura con una operación por tipo de cambio y
+    escribe en el libro los reversos de `previous` y los movimientos nuevos.
+    Las líneas toman la fecha de la factura.
+    """
+    for line in new + changed:
+        line.date = movement_date(line.invoice.date)
+    if new:
+        model.objects.bulk_create(new)
+    if changed:
+        now = timezone.now()
+        for line in changed:
+            line.updated_at = now
+        model.objects.bulk_update(changed, fields + ["date", "updated_at"])
+    record_movements(
+        [line_movement(old, -1) for old in previous.values()]
+        + [line_movement(line) for line in new + changed]
+    )
+    if deleted:
+        model.objects.filter(pk__in=[line.pk for line in deleted]).delete()
+
+
+def invoice_cost_changes(invoice, lines, previous):
+    """
+    Productos cuyo costo hay que recalcular tras guardar la factura: los de
+    líneas modificadas o eliminadas, y todos si la factura es de días atrás.
+    """
+    day = movement_date(invoice.date)
+    changes = {}
+    for old in previous.values():
+        add_change(changes, old.product_id, day)
+    if day < timezone.now().date():
+        for line in lines:
+            add_change(changes, line.product_id, day)
+    return changes
+
+
+def record_throughput(kind, lines, started):
+    """Suma las líneas aplicadas a las métricas al confirmar la transacción."""
+    seconds = time.perf_counter() - started
+    transaction.on_commit(lambda: record_posting(kind, lines, seconds))
+
+
+def post_purchase_invoice(formset):
+    """
+    Guarda las líneas de una factura de compra y aplica su efecto en el
+    stock y el costo promedio de una sola vez: las cantidades y valores se
+    acumulan por producto, así que la cantidad de consultas depende de los
+    productos distintos y no de las líneas.
+    """
+    started = time.perf_counter()
+    invoice = formset.instance
+    new, changed, deleted = formset_changes(formset)
+    previous = Purchase.objects.only("product", "quantity", "cost").in_bulk(
+        [line.pk for line in changed + deleted])
+    for old in previous.values():
+        # Las líneas guardadas ya están en la fecha actual de la factura
+        old.invoice = invoice
+
+    # producto → [cantidad que sale, valor que sale, cantidad que entra, valor que entra]
+    deltas = {}
+    for line in changed + deleted:
+        old = previous[line.pk]
+        delta = deltas.setdefault(old.product_id, [0, 0, 0, 0])
+        delta[0] += old.quantity
+        delta[1] += old.quantity * old.cost
+    for line in new + changed:
+        delta = deltas.setdefault(line.product_id, [0, 0, 0, 0])
+        delta[2] += line.quantity
+        delta[3] += line.quantity * line.cost
+
+    with transaction.atomic():
+        products = lock_products(list(deltas))
+        for product_id, (out_qty, out_value, in_qty, in_value) in deltas.items():
+            product = products[product_id]
+            stock, average_cost = product.stock, product.average_cost
+            if out_qty:
+                remaining = stock - out_qty
+                if remaining > 0:
+                    average_cost = (stock * average_cost - out_value) / remaining
+                else:
+                    average_cost = Decimal(0)
+                stock = remaining
+            if in_qty:
+                total = stock + in_qty
+                if total > 0:
+                    average_cost = (stock * average_cost + in_value) / total
+                else:
+                    average_cost = in_value / in_qty
+                stock = total
+            product.stock = stock
+            product.average_cost = Decimal(average_cost).quantize(CENT)
+        Product.objects.bulk_update(products.values(), ["stock", "average_cost"])
+        save_lines(Purchase, new, changed, deleted, previous,
+                   ["product", "quantity", "cost"])
+        recompute_costs(invoice_cost_changes(invoice, new + changed, previous))
+        refresh_invoice_totals(PurchaseInvoice, [invoice.pk])
+        bump_data_version()
+        record_throughput("purchase", len(new) + len(changed) + len(deleted), started)
+
+
+def post_sale_invoice(formset):
+    """
+    Guarda las líneas de una factura de venta, descuenta el stock con un
+    solo `bulk_update` y actualiza el resumen diario con un delta por
+    producto. Las líneas nuevas o modificadas toman el precio y costo
+    actuales del producto.
+    """
+    started = time.perf_counter()
+    invoice = formset.instance
+    new, changed, deleted = formset_changes(formset)
+    previous = Sale.objects.only(
+        "product", "quantity", "price", "cost",
+    ).in_bulk([line.pk for line in changed + deleted])
+    for old in previous.values():
+        # Las líneas guardadas ya están en la fecha actual de la factura
+        old.invoice = invoice
+
+    deltas = {}
+    for line in changed + deleted:
+        old = previous[line.pk]
+        deltas[old.product_id] = deltas.get(old.product_id, 0) + old.quantity
+    for line in new + changed:
+        deltas[line.product_id] = deltas.get(line.product_id, 0) - line.quantity
+
+    with transaction.atomic():
+        products = lock_products(list(deltas))
+        for product_id, delta in deltas.items():
+            products[product_id].stock += delta
+        Product.objects.bulk_update(products.values(), ["stock"])
+
+        for line in new + changed:
+            product = products[line.product_id]
+            line.price = product.price
+            line.cost = product.average_cost
+        save_lines(Sale, new, changed, deleted, previous,
+                   ["product", "quantity", "price", "cost"])
+        # Las líneas eliminadas ya se descontaron en la señal pre_delete
+        record_sale_changes([previous[line.pk] for line in changed], new + changed)
+        recompute_costs(invoice_cost_changes(invoice, new + changed, previous))
+        refresh_invoice_totals(SaleInvoice, [invoice.pk])
+        bump_data_version()
+        record_throughput("sale", len(new) + len(changed) + len(deleted), started)
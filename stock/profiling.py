@@ -0,0 +1,131 @@
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+
+# Archivos de cada captura
+CAPTURE_FILES = (".prof", ".collapsed.txt", ".json")
+
+
+def function_label(func):
+    """Nombre legible de una función de pstats: `nombre (archivo:línea)`."""
+    filename, line, name = func
+    if filename == "~":
+        return name.replace(";", ",")  # Función interna de C
+    parts = filename.replace("\\", "/").split("/")
+    return f"{name} ({'/'.join(parts[-2:])}:{line})".replace(";", ",")
+
+
+def capture_name(method, path):
+    """Nombre base de una captura: fecha, método y ruta legible."""
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "home"
+    return f"{datetime.now():%Y%m%d-%H%M%S-%f}_{method}_{slug[:60]}"
+
+
+class StackSampler:
+    """
+    Muestrea desde otro hilo, cada `interval` segundos, la pila completa
+    del hilo `thread_id` y cuenta las pilas colapsadas (`a;b;c muestras`,
+    el formato de flamegraph.pl y speedscope). cProfile solo guarda
+    llamador → llamado, así que el flamegraph sale de estas muestras.
+
+    Se usa como contexto; mientras dura baja el intervalo de cambio de
+    hilo del intérprete para que el muestreo tenga esa resolución.
+    """
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self._switch = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch, self.interval))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        sys.setswitchinterval(self._switch)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(function_label(
+                    (code.co_filename, code.co_firstlineno, code.co_name)))
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n"
+                       for stack, count in self.counts.most_common())
+
+
+def save_capture(profiler, sampler, directory, info, keep=50):
+    """
+    Guarda el perfil como `<nombre>.prof` (pstats), las muestras de
+    `sampler` como `<nombre>.collapsed.txt` y `info` (método, ruta,
+    estado, duración…) como `<nombre>.json` en `directory`, y borra las
+    capturas más antiguas para quedarse con `keep`. Devuelve el nombre base.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = capture_name(info["method"], info["path"].split("?")[0])
+    base = os.path.join(directory, name)
+    profiler.dump_stats(base + ".prof")
+    with open(base + ".collapsed.txt", "w", encoding="utf-8") as f:
+        f.write(sampler.collapsed())
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False)
+
+    for old in list_captures(directory)[keep:]:
+        for suffix in CAPTURE_FILES:
+            try:
+                os.remove(os.path.join(directory, old + suffix))
+            except FileNotFoundError:
+                pass
+    return name
+
+
+def list_captures(directory):
+    """Nombres base de las capturas de `directory`, la más reciente primero."""
+    try:
+        files = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted((f[:-len(".prof")] for f in files if f.endswith(".prof")),
+                  reverse=True)
+
+
+def capture_summary(directory, name, limit=10):
+    """
+    Datos de una captura para la página de perfiles: los de su `.json`
+    más las `limit` funciones con más tiempo acumulado.
+    """
+    base = os.path.join(directory, name)
+    try:
+        with open(base + ".json", encoding="utf-8") as f:
+            summary = json.load(f)
+    except FileNotFoundError:
+        summary = {}
+    stats = pstats.Stats(base + ".prof")
+    stats.sort_stats("cumulative")
+    summary["name"] = name
+    summary["top"] = []
+    for func in stats.fcn_list[:limit]:
+        calls, _, own, cumulative, _ = stats.stats[func]
+        summary["top"].append({
+            "function": function_label(func), "calls": calls,
+            "own_ms": own * 1000, "cumulative_ms": cumulative * 1000,
+        })
+    return summary
@@ -0,0 +1,79 @@
+import heapq
+from datetime import timedelta
+
+from django.db.models import Sum
+
+from .models import DailyProductSales, Product
+
+
+def sold_quantities(since, until=None):
+    """
+    Cantidad vendida por producto desde `since` en una sola consulta
+    sobre el resumen diario.
+    """
+    sales = DailyProductSales.objects.filter(date__gte=since)
+    if until is not None:
+        sales = sales.filter(date__lte=until)
+    return dict(
+        sales.order_by()
+        .values_list("product_id")
+        .annotate(total=Sum("quantity"))
+    )
+
+
+def projection_rows(today, days=365):
+    """
+    Genera la proyección de agotamiento de cada producto con stock.
+    Usa dos consultas en total sin importar la cantidad de productos.
+    """
+    sold = sold_quantities(today - timedelta(days=days))
+    products = Product.objects.filter(stock__gt=0).select_related("category")
+
+    for p in products.iterator(chunk_size=2000):
+        sold_days = sold.get(p.id, 0)
+        if sold_days > 0:
+            days_per_unit = days / sold_days
+            days_to_runout = p.stock * days_per_unit
+        else:
+            days_per_unit = None
+            days_to_runout = None
+        yield {
+            "product": p,
+            "sold_365": sold_days,
+            "days_per_unit": days_per_unit,
+            "days_to_runout": days_to_runout,
+        }
+
+
+def runout_ranking(today, limit, days=365):
+    """
+    Los `limit` productos que se agotarán primero, ordenados por días
+    restantes. Usa un heap acotado en lugar de ordenar toda la lista.
+    """
+    rows = (row for row in projection_rows(today, days)
+            if row["days_to_runout"] is not None)
+    return heapq.nsmallest(
+        limit, rows,
+        key=lambda r: (r["days_to_runout"], r["product"].name),
+    )
+
+
+def runout_page(today, page, per_page, days=365):
+    """
+    Página `page` (desde 1) del ranking de agotamiento.
+    Devuelve (filas, total de productos con proyección).
+    """
+    total = 0
+
+    def counted():
+        nonlocal total
+        for row in projection_rows(today, days):
+            if row["days_to_runout"] is not None:
+                total += 1
+                yield row
+
+    top = heapq.nsmallest(
+        page * per_page, counted(),
+        key=lambda r: (r["days_to_runout"], r["product"].name),
+    )
+    return top[(page - 1) * per_page:], total
@@ -0,0 +1,279 @@
+from datetime import timedelta
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import IntegrityError, transaction
+from django.db.models import (
+    Case, Count, F, Max, Min, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.utils import timezone
+
+from .models import DailyProductSales, Product, Purchase, Sale
+
+
+def apply_sale_delta(day, product_id, lines, quantity, revenue, cost):
+    """Suma (o resta) un delta a la fila (día, producto) del resumen."""
+    if not (lines or quantity or revenue or cost):
+        return
+    rows = DailyProductSales.objects.filter(date=day, product_id=product_id)
+    with transaction.atomic():
+        updated = rows.update(
+            lines=F("lines") + lines,
+            quantity=F("quantity") + quantity,
+            revenue=F("revenue") + revenue,
+            cost=F("cost") + cost,
+        )
+        if not updated:
+            category_id = Product.objects.filter(
+                pk=product_id).values_list("category_id", flat=True).get()
+            try:
+                with transaction.atomic():
+                    DailyProductSales.objects.create(
+                        date=day, product_id=product_id,
+                        category_id=category_id, lines=lines,
+                        quantity=quantity, revenue=revenue, cost=cost,
+                    )
+            except IntegrityError:
+                # Otra transacción creó la fila entre el UPDATE y el INSERT
+                rows.update(
+                    lines=F("lines") + lines,
+                    quantity=F("quantity") + quantity,
+                    revenue=F("revenue") + revenue,
+                    cost=F("cost") + cost,
+                )
+        if lines < 0:
+            rows.filter(lines__lte=0).delete()
+
+
+def apply_sale_deltas(deltas, batch_size=200):
+    """
+    Igual que `apply_sale_delta` para varias filas a la vez: `deltas` es
+    {(día, producto): (líneas, cantidad, ingreso, costo)}. Las filas que
+    faltan se crean en cero en bloque (ignorando las que otra transacción
+    haya creado) y luego todas se actualizan con un solo UPDATE por lote,
+    con un CASE por columna que siempre suma con F().
+    """
+    items = [(key, delta) for key, delta in deltas.items() if any(delta)]
+    for start in range(0, len(items), batch_size):
+        batch = dict(items[start:start + batch_size])
+        match = Q()
+        for day, product_id in batch:
+            match |= Q(date=day, product_id=product_id)
+        rows = DailyProductSales.objects.filter(match)
+        with transaction.atomic():
+            missing = set(batch) - set(rows.values_list("date", "product_id"))
+            if missing:
+                categories = dict(
+                    Product.objects.filter(pk__in={key[1] for key in missing})
+                    .values_list("pk", "category_id")
+                )
+                DailyProductSales.objects.bulk_create([
+                    DailyProductSales(date=day, product_id=product_id,
+                                      category_id=categories[product_id])
+                    for day, product_id in missing
+                ], ignore_conflicts=True)
+
+            columns = {"lines": [], "quantity": [], "revenue": [], "cost": []}
+            for (day, product_id), delta in batch.items():
+                condition = Q(date=day, product_id=product_id)
+                for whens, value in zip(columns.values(), delta):
+                    if value:
+                        whens.append(When(condition, then=Value(value)))
+            rows.update(**{
+                column: F(column) + Case(
+                    *whens, default=Value(0),
+                    output_field=DailyProductSales._meta.get_field(column))
+                for column, whens in columns.items() if whens
+            })
+            if any(delta[0] < 0 for delta in batch.values()):
+                rows.filter(lines__lte=0).delete()
+
+
+def record_sale_change(old, new):
+    """
+    Aplica al resumen la diferencia entre una línea de venta antes (`old`)
+    y después (`new`) de guardarla. Cualquiera de las dos puede ser None.
+    """
+    record_sale_changes([old] if old is not None else [],
+                        [new] if new is not None else [])
+
+
+def record_sale_changes(removed, added):
+    """
+    Igual que `record_sale_change` para varias líneas a la vez: resta las
+    líneas de `removed`, suma las de `added` y escribe un solo delta por
+    (día, producto).
+    """
+    contributions = {}
+    for sales, sign in ((removed, -1), (added, 1)):
+        for sale in sales:
+            key = (sale.invoice.date, sale.product_id)
+            delta = contributions.setdefault(key, [0, 0, 0, 0])
+            delta[0] += sign
+            delta[1] += sign * sale.quantity
+            delta[2] += sign * sale.quantity * sale.price
+            delta[3] += sign * sale.quantity * sale.cost
+
+    apply_sale_deltas(contributions)
+
+
+def move_invoice_sales(invoice, old_date, new_date):
+    """
+    Mueve las líneas ya guardadas de una factura de `old_date` a `new_date`.
+    Con `new_date=None` solo las descuenta (factura eliminada).
+    """
+    if new_date == old_date:
+        return
+    grouped = (
+        Sale.objects.filter(invoice=invoice)
+        .order_by()
+        .values("product_id")
+        .annotate(
+            lines=Count("pk"),
+            qty=Sum("quantity"),
+            revenue=Sum(F("quantity") * F("price")),
+            cost=Sum(F("quantity") * F("cost")),
+        )
+    )
+    deltas = {}
+    for row in grouped:
+        delta = (row["lines"], row["qty"], row["revenue"], row["cost"])
+        deltas[old_date, row["product_id"]] = tuple(-value for value in delta)
+        if new_date is not None:
+            deltas[new_date, row["product_id"]] = delta
+    apply_sale_deltas(deltas)
+
+
+def rebuild_daily_sales(chunk_days=31, batch_size=1000):
+    """
+    Reconstruye el resumen diario desde cero agregando las ventas en
+    bloques de `chunk_days` días. Devuelve la cantidad de filas creadas.
+    """
+    bounds = Sale.objects.aggregate(
+        first=Min("date"), last=Max("date"))
+    created = 0
+    with transaction.atomic():
+        DailyProductSales.objects.all().delete()
+        if bounds["first"] is None:
+            return 0
+
+        start = bounds["first"]
+        while start <= bounds["last"]:
+            end = start + timedelta(days=chunk_days)
+            grouped = (
+                Sale.objects.filter(
+                    date__gte=start, date__lt=end)
+                .order_by()
+                .values("date", "product_id", "product__category_id")
+                .annotate(
+                    lines=Count("pk"),
+                    qty=Sum("quantity"),
+                    revenue=Sum(F("quantity") * F("price")),
+                    cost=Sum(F("quantity") * F("cost")),
+                )
+            )
+            rows = [
+                DailyProductSales(
+                    date=row["date"],
+                    product_id=row["product_id"],
+                    category_id=row["product__category_id"],
+                    lines=row["lines"],
+                    quantity=row["qty"],
+                    revenue=row["revenue"],
+                    cost=row["cost"],
+                )
+                for row in grouped
+            ]
+            DailyProductSales.objects.bulk_create(rows, batch_size=batch_size)
+            created += len(rows)
+            start = end
+    return created
+
+
+def refresh_daily_sales(keys, product_ids=(), batch_size=200):
+    """
+    Recalcula desde las ventas solo las filas del resumen diario de `keys`
+    ({(día, producto)}), por lotes, y alinea la categoría de las filas de
+    los productos `product_ids` con la del producto. Es lo que necesita una
+    importación incremental en vez de `rebuild_daily_sales`.
+    """
+    keys = sorted(keys)
+    for start in range(0, len(keys), batch_size):
+        match = Q()
+        for day, product_id in keys[start:start + batch_size]:
+            match |= Q(date=day, product_id=product_id)
+        grouped = (
+            Sale.objects.filter(match)
+            .order_by()
+            .values("date", "product_id", "product__category_id")
+            .annotate(
+                lines=Count("pk"),
+                qty=Sum("quantity"),
+                revenue=Sum(F("quantity") * F("price")),
+                cost=Sum(F("quantity") * F("cost")),
+            )
+        )
+        with transaction.atomic():
+            DailyProductSales.objects.filter(match).delete()
+            DailyProductSales.objects.bulk_create([
+                DailyProductSales(
+                    date=row["date"],
+                    product_id=row["product_id"],
+                    category_id=row["product__category_id"],
+                    lines=row["lines"],
+                    quantity=row["qty"],
+                    revenue=row["revenue"],
+                    cost=row["cost"],
+                )
+                for row in grouped
+            ])
+
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        DailyProductSales.objects.filter(
+            product_id__in=product_ids[start:start + batch_size],
+        ).update(category_id=Subquery(
+            Product.objects.filter(pk=OuterRef("product_id")).values("category_id")[:1]
+        ))
+
+
+def refresh_invoice_totals(model, invoice_ids, batch_size=1000):
+    """
+    Recalcula desde sus líneas el total, la cantidad de líneas y el resumen
+    ("2 × Arroz, 1 × Frijol") guardados en las facturas `invoice_ids` de
+    `model` (PurchaseInvoice o SaleInvoice). Solo escribe las que cambian.
+    Devuelve la cantidad de facturas actualizadas.
+    """
+    line_model = model._meta.get_field("items").related_model
+    amount = "cost" if line_model is Purchase else "price"
+    ids = sorted(set(invoice_ids))
+    now = timezone.now()
+    updated = 0
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        totals = {pk: (Decimal(0), 0, "") for pk in chunk}
+        lines = (
+            line_model.objects.filter(invoice_id__in=chunk)
+            .order_by("invoice_id", "created_at", "pk")
+            .values_list("invoice_id", "quantity", amount, "product__name")
+        )
+        for invoice_id, rows in groupby(lines, key=itemgetter(0)):
+            rows = list(rows)
+            totals[invoice_id] = (
+                sum((quantity * value for _, quantity, value, _ in rows), Decimal(0)),
+                len(rows),
+                ", ".join(f"{quantity} × {name}" for _, quantity, _, name in rows),
+            )
+
+        changed = [
+            model(pk=pk, total=totals[pk][0], item_count=totals[pk][1],
+                  items_summary=totals[pk][2], updated_at=now)
+            for pk, total, item_count, summary in model.objects.filter(
+                pk__in=chunk).values_list("pk", "total", "item_count", "items_summary")
+            if (total, item_count, summary) != totals[pk]
+        ]
+        model.objects.bulk_update(
+            changed, ["total", "item_count", "items_summary", "updated_at"])
+        updated += len(changed)
+    return updated
@@ -0,0 +1,266 @@
+import math
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import bump_data_version
+from .costing import receive
+from .ledger import (CENT, line_movement, reconciling_adjustments,
+                     take_monthly_snapshots)
+from .models import (Category, DailyProductSales, DeletedRecord, Expense,
+                     ExpenseCategory, OtherIncome, OtherIncomeCategory,
+                     Product, ProductImage, Purchase, PurchaseInvoice, Sale,
+                     SaleInvoice, StockMovement, StockSnapshot)
+from .rollups import rebuild_daily_sales
+
+CATEGORY_NAMES = [
+    "Abarrotes", "Bebidas", "Lácteos", "Limpieza", "Cuidado personal",
+    "Snacks", "Panadería", "Mascotas", "Papelería", "Ferretería",
+]
+BRANDS = ["La Perfecta", "Eskimo", "Coca-Cola", "Lala", "Xtra", "Maggi",
+          "Colgate", "Bimbo", "Dos Pinos", "Genérica"]
+SUPPLIERS = ["Distribuidora Central", "Mayorista del Norte", "Aliexpress",
+             "Importadora Pacífico", "Casa Comercial Sur"]
+CUSTOMERS = ["Generic"] * 8 + ["Pulpería El Carmen", "Comedor Doña Ana"]
+
+# Líneas por factura de venta y unidades por línea (peso relativo)
+LINES_PER_INVOICE = ((1, 2, 3, 4, 5, 8), (35, 25, 18, 10, 7, 5))
+UNITS_PER_LINE = ((1, 2, 3, 4, 6, 12), (50, 22, 12, 7, 6, 3))
+# Lunes a domingo: más ventas el fin de semana
+WEEKDAY_WEIGHTS = (0.85, 0.85, 0.9, 0.95, 1.15, 1.35, 1.0)
+
+MONTHLY_EXPENSES = (("Alquiler", 6000, 6000), ("Servicios", 1200, 2200),
+                    ("Salarios", 9000, 9500))
+DAILY_EXPENSES = (("Transporte", 80, 400, 0.4), ("Mantenimiento", 200, 1500, 0.03))
+OTHER_INCOMES = (("Envíos", 50, 300, 0.08), ("Recargas", 20, 150, 0.3))
+
+
+def clear_stock_data():
+    """
+    Borra todos los datos del negocio (no los usuarios) con un DELETE por
+    tabla en orden de dependencias. No pasa por las señales de borrado:
+    no deja registros de eliminación (también se vacían) ni invalida la
+    caché fila por fila, solo una vez al final.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in (StockSnapshot, StockMovement, DailyProductSales, Sale,
+                      Purchase, SaleInvoice, PurchaseInvoice, ProductImage,
+                      Product, Category, Expense, ExpenseCategory, OtherIncome,
+                      OtherIncomeCategory, DeletedRecord):
+            cursor.execute(
+                f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")
+        bump_data_version()
+
+
+def day_weight(day, progress):
+    """
+    Peso relativo de las ventas de un día: estacionalidad anual, día de
+    la semana, diciembre más fuerte y un crecimiento del negocio con el
+    tiempo (`progress` va de 0 a 1 en el período).
+    """
+    season = 1 + 0.2 * math.sin(2 * math.pi * (day.timetuple().tm_yday - 80) / 365)
+    december = 1.5 if day.month == 12 else 1.0
+    return season * december * WEEKDAY_WEIGHTS[day.weekday()] * (0.7 + 0.6 * progress)
+
+
+def seed_stock(categories=10, products=200, years=3, sale_lines=100_000,
+               seed=1, batch_size=5000, log=None):
+    """
+    Genera un conjunto de datos sintético y realista: categorías, productos
+    con popularidad sesgada (Zipf), años de facturas de venta con
+    estacionalidad, compras de reposición cuando baja el stock, gastos y
+    otros ingresos. Con la misma `seed` se obtienen los mismos datos.
+
+    Escribe con bulk_create en lotes de `batch_size` líneas y simula el
+    costo promedio móvil mientras genera, así que las ventas llevan el
+    costo correcto y el stock final cuadra con la historia. El libro de
+    movimientos se escribe junto con las líneas; al terminar se
+    reconstruyen el resumen diario y las instantáneas mensuales.
+    Devuelve la cantidad de filas por modelo.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    today = timezone.now().date()
+    start = today - timedelta(days=365 * years - 1)
+    days = [start + timedelta(days=i) for i in range(365 * years)]
+    counts = dict.fromkeys(
+        ["Product", "PurchaseInvoice", "Purchase", "SaleInvoice", "Sale",
+         "Expense", "OtherIncome"], 0)
+
+    # ===== Catálogo =====
+    category_objs = Category.objects.bulk_create([
+        Category(name=CATEGORY_NAMES[i % len(CATEGORY_NAMES)]
+                 + (f" {i // len(CATEGORY_NAMES) + 1}" if i >= len(CATEGORY_NAMES) else ""))
+        for i in range(categories)
+    ])
+    base_costs = [
+        Decimal(str(round(min(rng.lognormvariate(3.5, 1.0), 5000), 2))).max(Decimal("1.00"))
+        for _ in range(products)
+    ]
+    markups = [Decimal(str(round(rng.uniform(1.2, 1.8), 2))) for _ in range(products)]
+    product_objs = Product.objects.bulk_create([
+        Product(
+            name=f"{category_objs[i % categories].name} {i + 1:05d}",
+            category=category_objs[i % categories],
+            brand=rng.choice(BRANDS),
+            price=(base_costs[i] * markups[i]).quantize(CENT),
+        )
+        for i in range(products)
+    ], batch_size=batch_size)
+    counts["Product"] = len(product_objs)
+    names = {p.pk: p.name for p in product_objs}
+    prices = [p.price for p in product_objs]
+
+    # Popularidad Zipf sobre un orden aleatorio de productos
+    ranks = list(range(products))
+    rng.shuffle(ranks)
+    popularity = [1 / (rank + 1) ** 1.1 for rank in ranks]
+    cum_popularity = []
+    total = 0
+    for weight in popularity:
+        total += weight
+        cum_popularity.append(total)
+    product_ids = list(range(products))
+
+    line_counts, line_weights = LINES_PER_INVOICE
+    unit_counts, unit_weights = UNITS_PER_LINE
+    mean_units = sum(c * w for c, w in zip(unit_counts, unit_weights)) / sum(unit_weights)
+    line_cum = [sum(line_weights[:i + 1]) for i in range(len(line_weights))]
+    unit_cum = [sum(unit_weights[:i + 1]) for i in range(len(unit_weights))]
+
+    weights = [day_weight(day, i / len(days)) for i, day in enumerate(days)]
+    lines_per_weight = sale_lines / sum(weights)
+
+    # Reposición: punto de pedido ~1 semana y pedido hasta ~1 mes de demanda
+    daily_units = [
+        sale_lines / len(days) * mean_units * weight / total for weight in popularity
+    ]
+    reorder = [max(int(units * 7), 2) for units in daily_units]
+    target = [max(int(units * 30), 10) for units in daily_units]
+
+    stock = [0] * products
+    average_cost = [Decimal(0)] * products
+    low = set(product_ids)  # Todos empiezan sin stock
+
+    expense_categories = {name: ExpenseCategory.objects.create(name=name)
+                          for name, *_ in MONTHLY_EXPENSES + DAILY_EXPENSES}
+    income_categories = {name: OtherIncomeCategory.objects.create(name=name)
+                         for name, *_ in OTHER_INCOMES}
+
+    pending = {"purchase": [], "sale": [], "expense": [], "income": []}
+    # product_id → [stock, valor] según los movimientos escritos en el libro
+    ledger_totals = {p.pk: [0, Decimal(0)] for p in product_objs}
+    pending_lines = [0]
+
+    def flush():
+        with transaction.atomic():
+            for kind, invoice_model, line_model in (
+                    ("purchase", PurchaseInvoice, Purchase),
+                    ("sale", SaleInvoice, Sale)):
+                invoices = pending[kind]
+                invoice_model.objects.bulk_create(
+                    [invoice for invoice, _ in invoices], batch_size=batch_size)
+                lines = [line for _, invoice_lines in invoices for line in invoice_lines]
+                line_model.objects.bulk_create(lines, batch_size=batch_size)
+                # El libro se escribe junto con las líneas: evita releerlas
+                movements = [line_movement(line) for line in lines]
+                StockMovement.objects.bulk_create(movements, batch_size=batch_size)
+                for movement in movements:
+                    totals = ledger_totals[movement.product_id]
+                    totals[0] += movement.quantity
+                    totals[1] += movement.value
+                counts[invoice_model.__name__] += len(invoices)
+                counts[line_model.__name__] += len(lines)
+            Expense.objects.bulk_create(pending["expense"], batch_size=batch_size)
+            OtherIncome.objects.bulk_create(pending["income"], batch_size=batch_size)
+            counts["Expense"] += len(pending["expense"])
+            counts["OtherIncome"] += len(pending["income"])
+        for values in pending.values():
+            values.clear()
+        pending_lines[0] = 0
+
+    def add_invoice(kind, invoice, lines, amount):
+        invoice.item_count = len(lines)
+        invoice.total = sum((line.quantity * getattr(line, amount) for line in lines),
+                            Decimal(0))
+        invoice.items_summary = ", ".join(
+            f"{line.quantity} × {names[line.product_id]}" for line in lines)
+        pending[kind].append((invoice, lines))
+        pending_lines[0] += len(lines)
+
+    for i, day in enumerate(days):
+        inflation = Decimal(str(round(1.05 ** (i / 365), 4)))
+
+        # Reposición al abrir: una factura de compra con lo que está bajo
+        if low:
+            invoice = PurchaseInvoice(date=day, supplier=rng.choice(SUPPLIERS))
+            lines = []
+            for p in sorted(low):
+                quantity = target[p] - stock[p]
+                cost = (base_costs[p] * inflation
+                        * Decimal(str(round(rng.uniform(0.95, 1.05), 3)))).quantize(CENT)
+                lines.append(Purchase(invoice=invoice, product=product_objs[p],
+                                      quantity=quantity, cost=cost, date=day))
+                average_cost[p] = receive(stock[p], average_cost[p], quantity, cost)
+                stock[p] += quantity
+                if cost * Decimal("1.15") > prices[p]:
+                    prices[p] = (cost * markups[p]).quantize(CENT)
+            low.clear()
+            add_invoice("purchase", invoice, lines, "cost")
+
+        # Ventas del día
+        remaining = int(weights[i] * lines_per_weight + rng.random())
+        while remaining > 0:
+            count = min(rng.choices(line_counts, cum_weights=line_cum)[0], remaining)
+            remaining -= count
+            invoice = SaleInvoice(date=day, customer=rng.choice(CUSTOMERS))
+            lines = []
+            for p in rng.choices(product_ids, cum_weights=cum_popularity, k=count):
+                quantity = rng.choices(unit_counts, cum_weights=unit_cum)[0]
+                lines.append(Sale(invoice=invoice, product=product_objs[p],
+                                  quantity=quantity, price=prices[p],
+                                  cost=average_cost[p], date=day))
+                stock[p] -= quantity
+                if stock[p] < reorder[p]:
+                    low.add(p)
+            add_invoice("sale", invoice, lines, "price")
+
+        # Gastos y otros ingresos
+        if day.day == 1:
+            for name, low_amount, high_amount in MONTHLY_EXPENSES:
+                pending["expense"].append(Expense(
+                    date=day, category=expense_categories[name], description=name,
+                    amount=Decimal(rng.randint(low_amount, high_amount))))
+        for name, low_amount, high_amount, chance in DAILY_EXPENSES:
+            if rng.random() < chance:
+                pending["expense"].append(Expense(
+                    date=day, category=expense_categories[name], description=name,
+                    amount=Decimal(rng.randint(low_amount, high_amount))))
+        for name, low_amount, high_amount, chance in OTHER_INCOMES:
+            if rng.random() < chance:
+                pending["income"].append(OtherIncome(
+                    date=day, category=income_categories[name], description=name,
+                    amount=Decimal(rng.randint(low_amount, high_amount))))
+
+        if pending_lines[0] >= batch_size:
+            flush()
+            log(f"{day.isoformat()}: {counts['Sale']} líneas de venta")
+    flush()
+
+    # ===== Datos derivados =====
+    for product, p in zip(product_objs, product_ids):
+        product.stock = stock[p]
+        product.average_cost = average_cost[p]
+        product.price = prices[p]
+    Product.objects.bulk_update(product_objs, ["stock", "average_cost", "price"],
+                                batch_size=batch_size)
+    log("Reconstruyendo resumen diario…")
+    rebuild_daily_sales()
+    StockMovement.objects.bulk_create(reconciling_adjustments(ledger_totals),
+                                      batch_size=batch_size)
+    take_monthly_snapshots(today)
+    bump_data_version()
+    return counts
@@ -0,0 +1,58 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+
+from django.apps import apps
+
+from .backup import BACKUP_MODELS
+from .caching import bump_data_version
+from .models import (
+    Category, Product, Purchase, Sale, Expense,
+    PurchaseInvoice, SaleInvoice, OtherIncome,
+    DeletedRecord,
+)
+
+# Modelos cuyos cambios afectan las métricas del dashboard
+TRACKED_MODELS = [
+    Category, Product, Purchase, Sale, Expense,
+    PurchaseInvoice, SaleInvoice, OtherIncome,
+]
+
+
+def invalidate_cached_reports(sender, **kwargs):
+    if kwargs.get("raw"):
+        # loaddata / restauraciones: la vista de importación invalida al final
+        return
+    bump_data_version()
+
+
+for model in TRACKED_MODELS:
+    post_save.connect(invalidate_cached_reports, sender=model,
+                      dispatch_uid=f"invalidate_cached_reports_save_{model.__name__}")
+    post_delete.connect(invalidate_cached_reports, sender=model,
+                        dispatch_uid=f"invalidate_cached_reports_delete_{model.__name__}")
+
+
+def record_deletion(sender, instance, **kwargs):
+    """Deja constancia del borrado para los respaldos incrementales."""
+    DeletedRecord.objects.create(model_name=sender.__name__,
+                                 object_id=instance.pk)
+
+
+for model_name in BACKUP_MODELS:
+    post_delete.connect(record_deletion, sender=apps.get_model("stock", model_name),
+                        dispatch_uid=f"record_deletion_{model_name}")
+
+
+def discount_deleted_sale(sender, instance, **kwargs):
+    """
+    Descuenta del resumen diario una línea de venta eliminada, venga de
+    Sale.delete, de un borrado de queryset (admin, importación) o de la
+    cascada al eliminar su factura o su producto.
+    """
+    from .rollups import apply_sale_delta
+    quantity = instance.quantity
+    apply_sale_delta(instance.date, instance.product_id, -1, -quantity,
+                     -quantity * instance.price, -quantity * instance.cost)
+
+
+pre_delete.connect(discount_deleted_sale, sender=Sale,
+                   dispatch_uid="discount_deleted_sale")
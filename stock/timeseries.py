@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.db.models import DateField, Sum
+from django.db.models.functions import Trunc
+
+from .models import DailyProductSales
+
+# Ventanas permitidas en el gráfico del dashboard → agrupación por defecto
+SALES_WINDOWS = {
+    7: "day",
+    30: "day",
+    90: "week",
+    365: "month",
+}
+
+BUCKET_LABELS = {
+    "day": "%a %d",
+    "week": "Sem %d/%m",
+    "month": "%b %Y",
+}
+
+
+def bucket_start(day, bucket):
+    """Primer día del bucket (día, semana de lunes o mes) que contiene `day`."""
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(start, bucket):
+    if bucket == "week":
+        return start + timedelta(days=7)
+    if bucket == "month":
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    return start + timedelta(days=1)
+
+
+def sales_series(end_date, days, bucket="day"):
+    """
+    Ingresos por venta de los últimos `days` días (incluyendo `end_date`)
+    agrupados por día, semana o mes en una sola consulta.
+    Los buckets sin ventas se rellenan con 0.
+
+    Devuelve (etiquetas, valores) listos para Chart.js.
+    """
+    start_date = end_date - timedelta(days=days - 1)
+    totals = dict(
+        DailyProductSales.objects.filter(
+            date__gte=start_date, date__lte=end_date,
+        )
+        .annotate(bucket=Trunc("date", bucket, output_field=DateField()))
+        .order_by()
+        .values_list("bucket")
+        .annotate(total=Sum("revenue"))
+    )
+
+    labels = []
+    values = []
+    current = bucket_start(start_date, bucket)
+    while current <= end_date:
+        labels.append(current.strftime(BUCKET_LABELS[bucket]))
+        values.append(float(totals.get(current, 0)))
+        current = next_bucket(current, bucket)
+    return labels, values
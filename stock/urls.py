@@ -9,6 +9,8 @@ urlpatterns = [
     path("top-productos/", views.top_products_view, {"period": "mes"}, name="top_products"),
     re_path(r"^(?P<model_str>category|product|sale|purchase|expense|expensecategory|otherincome|otherincomecategory)$",
             views.generic_list_view, name="list"),
+    re_path(r"^(?P<model_str>category|product|sale|purchase|expense|expensecategory|otherincome|otherincomecategory)/data$",
+            views.generic_list_data_view, name="list_data"),
     # CRUD genérico para modelos simples (excepto product, que usa su propia vista)
     re_path(r"^(?P<model_str>category|expense|expensecategory|otherincome|otherincomecategory)/new$",
             views.generic_form_view, name="new"),
@@ -27,7 +29,13 @@ urlpatterns = [
     path("resultados/<int:month_offset>/",
          views.month_result, name="month_result"),
     path("resultados/", views.month_result, {"month_offset": 0}),
+    path("proyeccion/", views.runout_report_view, name="runout_report"),
+    path("inventario/valor/", views.valuation_report_view, name="valuation_report"),
+    path("inventario/valor/data", views.valuation_data_view, name="valuation_data"),
     path("perfil/", views.user_profile, name="user_profile"),
     path("exportar/", views.export_data, name="export_data"),
     path("importar/", views.import_data, name="import_data"),
+    path("perfiles/", views.profiles_view, name="profiles"),
+    path("perfiles/<str:filename>", views.profile_file_view, name="profile_file"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
\ No newline at end of file
@@ -0,0 +1,92 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import DateField, Sum
+from django.db.models.functions import Trunc
+
+from .ledger import CENT, balances_as_of, month_ends
+from .models import Product, StockMovement
+
+
+def inventory_value(day):
+    """Valor total del inventario al cierre de `day`."""
+    total = sum((value for _stock, value in balances_as_of(day).values()),
+                Decimal(0))
+    return Decimal(total).quantize(CENT)
+
+
+def valuation_as_of(day):
+    """
+    Valor del inventario al cierre de `day` por producto y por categoría,
+    a partir de las instantáneas y el libro de movimientos.
+
+    Devuelve (productos, categorías, total). Cada producto es un dict con
+    product, stock, value y average_cost; las categorías se ordenan por valor.
+    """
+    balances = balances_as_of(day)
+    products = Product.objects.select_related("category")
+
+    rows = []
+    categories = {}
+    for product in products.iterator(chunk_size=2000):
+        stock, value = balances.get(product.pk, (0, 0))
+        if not (stock or value):
+            continue
+        value = Decimal(value).quantize(CENT)
+        rows.append({
+            "product": product,
+            "stock": stock,
+            "value": value,
+            "average_cost": (value / stock).quantize(CENT) if stock else None,
+        })
+        category = categories.setdefault(product.category_id, {
+            "category": product.category.name, "stock": 0, "value": Decimal(0),
+        })
+        category["stock"] += stock
+        category["value"] += value
+
+    rows.sort(key=lambda r: (-r["value"], r["product"].name))
+    by_category = sorted(categories.values(),
+                         key=lambda c: (-c["value"], c["category"]))
+    total = sum((c["value"] for c in by_category), Decimal(0))
+    return rows, by_category, total
+
+
+def month_end_series(day, months=24):
+    """
+    Valor total del inventario al cierre de cada uno de los últimos
+    `months` meses cerrados hasta `day`. Parte del saldo anterior al
+    primer cierre y recorre una sola vez los movimientos del período,
+    agrupados por mes en la base de datos.
+
+    Devuelve una lista de (fecha de cierre, stock, valor).
+    """
+    first_month = day.replace(day=1)
+    for _ in range(months):
+        first_month = (first_month - timedelta(days=1)).replace(day=1)
+    ends = month_ends(first_month, day)[-months:]
+    if not ends:
+        return []
+
+    opening = ends[0].replace(day=1) - timedelta(days=1)
+    balances = balances_as_of(opening).values()
+    stock = sum(balance[0] for balance in balances)
+    value = sum((balance[1] for balance in balances), Decimal(0))
+
+    monthly = dict(
+        (month, (quantity, amount)) for month, quantity, amount in (
+            StockMovement.objects.filter(date__gt=opening, date__lte=ends[-1])
+            .annotate(month=Trunc("date", "month", output_field=DateField()))
+            .order_by()
+            .values_list("month")
+            .annotate(qty=Sum("quantity"), total=Sum("value"))
+        )
+    )
+
+    series = []
+    for end in ends:
+        quantity, amount = monthly.get(end.replace(day=1), (0, 0))
+        stock += quantity
+        value += amount
+        series.append((end, stock, Decimal(value).quantize(CENT)))
+    return series
@@ -1,6 +1,7 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.forms import inlineformset_factory
 from django.urls import reverse
 from .models import (
@@ -8,21 +9,47 @@ from .models import (
     Purchase, Sale, Expense,
     PurchaseInvoice, SaleInvoice,
     OtherIncomeCategory, OtherIncome,
+    DailyProductSales,
 )
 from .forms import (
     CategoryForm, ExpenseCategoryForm, ProductForm, ExpenseForm,
     PurchaseInvoiceForm, PurchaseItemForm,
     SaleInvoiceForm, SaleItemForm,
+    InvoiceItemFormSet,
     ProductImageFormSet,
     OtherIncomeCategoryForm, OtherIncomeForm,
 )
+from .templatetags.getattribute import format_value
+from .backup import (
+    backup_sequence, buffered, gzipped, import_backup, iter_backup_json,
+    open_backup, parse_checkpoint, read_backup_metadata,
+)
+from .caching import (
+    bump_data_version, cache_is_shared, cached_dashboard, dashboard_age,
+)
+from .metrics import render_metrics
+from .periods import period_totals
+from .ledger import (
+    rebuild_ledger, record_adjustment, refresh_line_movements,
+    take_monthly_snapshots,
+)
+from .posting import lock_product, post_purchase_invoice, post_sale_invoice
+from .rollups import rebuild_daily_sales, refresh_daily_sales
+from .profiling import CAPTURE_FILES, capture_summary, list_captures
+from .projection import runout_ranking, runout_page
+from .timeseries import SALES_WINDOWS, sales_series
+from .valuation import inventory_value, month_end_series, valuation_as_of
 from django.apps import apps
-from django.db.models import Sum, F
+from django.conf import settings
+from django.db.models import Sum, F, Q
 from django.utils.timezone import now
 from datetime import timedelta, date
 import json
-from django.http import HttpResponse, Http404
-from django.core import serializers
+import os
+from django.http import (FileResponse, Http404, HttpResponse, HttpResponseForbidden,
+                         JsonResponse, StreamingHttpResponse)
+from django.core.serializers.base import DeserializationError
+from django.db import IntegrityError, transaction
 
 
 # Mapeo de model_str → nombre de modelo real (para apps.get_model)
@@ -35,8 +62,15 @@ MODEL_NAME_MAP = {
 }
 
 
-@login_required
-def generic_list_view(request, model_str):
+LIST_PAGE_SIZE = 25
+LIST_MAX_PAGE_SIZE = 100
+
+
+def list_config(model_str):
+    """
+    Configuración de los listados genéricos: columnas, título, queryset
+    base, campos de búsqueda y columnas ordenables (columna → lookup).
+    """
     valid_models = {"category", "product", "sale", "purchase", "expense",
                     "expensecategory", "otherincome", "otherincomecategory"}
     if model_str not in valid_models:
@@ -48,89 +82,186 @@ def generic_list_view(request, model_str):
     except LookupError:
         raise Http404
 
-    # Compras y ventas usan facturas con varias líneas
-    if model_str in ("purchase", "sale"):
-        invoices = model.objects.all()
-        rows = []
-        for inv in invoices:
-            rows.append({
-                "id": inv.id,
-                "date": inv.date,
-                "party": inv.supplier if model_str == "purchase" else inv.customer,
-                "items_summary": ", ".join(
-                    f"{i.quantity} × {i.product.name}"
-                    for i in inv.items.all()
-                ),
-                "total": inv.get_total(),
-            })
-        if model_str == "purchase":
-            fields = ["Fecha", "Proveedor", "Productos", "Total"]
-            columns = ["date", "party", "items_summary", "total"]
-            title = "Compras"
-        else:
-            fields = ["Fecha", "Cliente", "Productos", "Total"]
-            columns = ["date", "party", "items_summary", "total"]
-            title = "Ventas"
-        context = {
-            "model": model_str,
-            "title": title,
-            "fields": fields,
-            "columns": columns,
-            "page_obj": rows,
-        }
-        return render(request, "list.html", context)
-
-    queryset = model.objects.all()
-
-    fields = []
-    columns = []
-    title = ""
+    config = {
+        "model": model,
+        "queryset": model.objects.all(),
+        "fields": [],
+        "columns": [],
+        "title": "",
+        "search": [],
+        "item_search": None,
+        "sort": {},
+        "rows": None,
+    }
 
     match model_str:
+        case "purchase" | "sale":
+            # Compras y ventas usan facturas con varias líneas
+            party = "supplier" if model_str == "purchase" else "customer"
+            item_model = Purchase if model_str == "purchase" else Sale
+            config.update({
+                "fields": ["Fecha",
+                           "Proveedor" if model_str == "purchase" else "Cliente",
+                           "Productos", "Total"],
+                "columns": ["date", "party", "items_summary", "total"],
+                "title": "Compras" if model_str == "purchase" else "Ventas",
+                "search": [party],
+                "item_search": item_model,
+                "sort": {"date": "date", "party": party, "total": "total"},
+                "rows": lambda page: invoice_rows(page, model_str),
+            })
+
         case "category":
-            fields = ["Nombre"]
-            columns = ["name"]
-            title = "Categorías"
+            config.update({
+                "fields": ["Nombre"],
+                "columns": ["name"],
+                "title": "Categorías",
+                "search": ["name"],
+                "sort": {"name": "name"},
+            })
 
         case "expensecategory":
-            fields = ["Nombre"]
-            columns = ["name"]
-            title = "Categorías de Gastos"
+            config.update({
+                "fields": ["Nombre"],
+                "columns": ["name"],
+                "title": "Categorías de Gastos",
+                "search": ["name"],
+                "sort": {"name": "name"},
+            })
 
         case "otherincomecategory":
-            fields = ["Nombre"]
-            columns = ["name"]
-            title = "Categorías de Otros Ingresos"
+            config.update({
+                "fields": ["Nombre"],
+                "columns": ["name"],
+                "title": "Categorías de Otros Ingresos",
+                "search": ["name"],
+                "sort": {"name": "name"},
+            })
 
         case "product":
-            fields = ["Nombre", "Categoría", "Marca",
-                      "Stock", "Precio", "Costo Promedio"]
-            columns = ["name", "category__name", "brand",
-                       "stock", "price", "average_cost"]
-            title = "Productos"
+            config.update({
+                "queryset": model.objects.select_related("category"),
+                "fields": ["Nombre", "Categoría", "Marca",
+                           "Stock", "Precio", "Costo Promedio"],
+                "columns": ["name", "category__name", "brand",
+                            "stock", "price", "average_cost"],
+                "title": "Productos",
+                "search": ["name", "category__name", "brand"],
+            })
+            config["sort"] = {col: col for col in config["columns"]}
+
+        case "expense" | "otherincome":
+            config.update({
+                "queryset": model.objects.select_related("category"),
+                "fields": ["Fecha", "Categoría", "Descripción", "Monto"],
+                "columns": ["date", "category__name", "description", "amount"],
+                "title": "Gastos" if model_str == "expense" else "Otros Ingresos",
+                "search": ["category__name", "description"],
+            })
+            config["sort"] = {col: col for col in config["columns"]}
 
-        case "expense":
-            queryset = queryset.select_related("category")
-            fields = ["Fecha", "Categoría", "Descripción", "Monto"]
-            columns = ["date", "category__name", "description", "amount"]
-            title = "Gastos"
+    return config
+
+
+def invoice_rows(invoices, model_str):
+    """
+    Filas del listado de facturas con el total y el resumen guardados en
+    la factura: una consulta por página, sin cargar las líneas.
+    """
+    return [
+        {
+            "id": inv.id,
+            "date": inv.date,
+            "party": inv.supplier if model_str == "purchase" else inv.customer,
+            "items_summary": inv.items_summary,
+            "total": inv.total,
+        }
+        for inv in invoices
+    ]
 
-        case "otherincome":
-            queryset = queryset.select_related("category")
-            fields = ["Fecha", "Categoría", "Descripción", "Monto"]
-            columns = ["date", "category__name", "description", "amount"]
-            title = "Otros Ingresos"
 
+def list_action_urls(model_str, pk):
+    """URLs de detalle y edición de una fila ('detalle|edición' o solo edición)."""
+    match model_str:
+        case "purchase":
+            return (f"{reverse('purchase_invoice_detail', args=[pk])}|"
+                    f"{reverse('purchase_invoice_edit', args=[pk])}")
+        case "sale":
+            return (f"{reverse('sale_invoice_detail', args=[pk])}|"
+                    f"{reverse('sale_invoice_edit', args=[pk])}")
+        case "product":
+            return (f"{reverse('product_detail', args=[pk])}|"
+                    f"{reverse('product_edit', args=[pk])}")
+    return reverse("edit", args=[model_str, pk])
+
+
+@login_required
+def generic_list_view(request, model_str):
+    config = list_config(model_str)
     context = {
         "model": model_str,
-        "title": title,
-        "fields": fields,
-        "columns": columns,
-        "page_obj": queryset,
+        "title": config["title"],
+        "fields": config["fields"],
+        "columns": config["columns"],
+        "sortable": [col in config["sort"] for col in config["columns"]],
+        "data_url": reverse("list_data", args=[model_str]),
     }
     return render(request, "list.html", context)
 
 
+@login_required
+def generic_list_data_view(request, model_str):
+    """
+    Datos paginados de un listado para Grid.js en modo servidor.
+    Parámetros: search, order (índice de columna), dir (asc/desc),
+    limit y offset. La búsqueda, el orden y la paginación se hacen en SQL.
+    """
+    config = list_config(model_str)
+    columns = config["columns"]
+    queryset = config["queryset"]
+
+    search = request.GET.get("search", "").strip()
+    if search:
+        condition = Q()
+        for lookup in config["search"]:
+            condition |= Q(**{f"{lookup}__icontains": search})
+        if config["item_search"]:
+            condition |= Q(pk__in=config["item_search"].objects.filter(
+                product__name__icontains=search).values("invoice_id"))
+        queryset = queryset.filter(condition)
+
+    total = queryset.count()
+
+    ordering = list(config["model"]._meta.ordering)
+    try:
+        column = columns[int(request.GET["order"])]
+    except (KeyError, ValueError, IndexError):
+        column = None
+    if column in config["sort"]:
+        prefix = "-" if request.GET.get("dir") == "desc" else ""
+        ordering = [prefix + config["sort"][column]]
+    queryset = queryset.order_by(*ordering, "pk")
+
+    try:
+        limit = min(max(int(request.GET.get("limit", LIST_PAGE_SIZE)), 1),
+                    LIST_MAX_PAGE_SIZE)
+        offset = max(int(request.GET.get("offset", 0)), 0)
+    except ValueError:
+        limit, offset = LIST_PAGE_SIZE, 0
+    page = queryset[offset:offset + limit]
+    if config["rows"]:
+        page = config["rows"](page)
+
+    results = []
+    for item in page:
+        pk = item["id"] if isinstance(item, dict) else item.pk
+        results.append(
+            [format_value(item, col) for col in columns]
+            + [list_action_urls(model_str, pk)]
+        )
+    return JsonResponse({"total": total, "results": results})
+
+
 @login_required
 def generic_form_view(request, model_str, pk=None):
     valid_models = {"category", "expense", "expensecategory",
@@ -180,6 +311,53 @@ def generic_form_view(request, model_str, pk=None):
     return render(request, "form.html", context)
 
 
+def save_product(form, formset):
+    """
+    Guarda un ProductForm válido y sus fotos (`formset`). Al editar, el
+    stock y el costo no se escriben con el resto de los campos: si se
+    cambiaron, se aplican con el producto bloqueado y quedan como ajuste
+    en el libro. Si mientras tanto una venta o compra los cambió, se
+    rechaza con un error en el formulario y no se guarda nada.
+    Devuelve si se guardó.
+    """
+    stock = form.cleaned_data["stock"]
+    average_cost = form.cleaned_data["average_cost"]
+    with transaction.atomic():
+        if form.instance._state.adding:
+            product = form.save(commit=False)
+            product.stock = stock
+            product.average_cost = average_cost
+            product.save()
+            record_adjustment(product, 0, 0)
+        else:
+            # Bloquear antes de leer el stock actual
+            current = lock_product(form.instance.pk)
+            changed = form.stock_changed()
+            shown = (form.cleaned_data["shown_stock"],
+                     form.cleaned_data["shown_average_cost"])
+            if changed and shown != (current["stock"], current["average_cost"]):
+                form.add_error("stock", (
+                    f"El stock o el costo cambiaron mientras editabas (ahora: "
+                    f"stock {current['stock']}, costo {current['average_cost']}). "
+                    "Vuelve a abrir el producto para ajustarlo."))
+                return False
+
+            product = form.save(commit=False)
+            product.save(update_fields=[*form._meta.fields, "updated_at"])
+            if changed:
+                Product.objects.filter(pk=product.pk).update(
+                    stock=F("stock") + (stock - current["stock"]),
+                    average_cost=average_cost,
+                )
+                product.stock = stock
+                product.average_cost = average_cost
+                # Cambio manual de inventario: queda como ajuste en el libro
+                record_adjustment(product, current["stock"], current["average_cost"])
+        formset.instance = product
+        formset.save()
+    return True
+
+
 @login_required
 def product_form_view(request, pk=None):
     """Vista dedicada para crear/editar productos con marca y múltiples fotos."""
@@ -190,10 +368,7 @@ def product_form_view(request, pk=None):
         form = ProductForm(request.POST, request.FILES, instance=product)
         formset = ProductImageFormSet(request.POST, request.FILES,
                                       instance=product)
-        if form.is_valid() and formset.is_valid():
-            product = form.save()
-            formset.instance = product
-            formset.save()
+        if form.is_valid() and formset.is_valid() and save_product(form, formset):
             messages.success(request, "Se ha guardado correctamente.")
             return redirect("product_new")
     else:
@@ -224,11 +399,11 @@ def product_detail_view(request, pk):
 # ===== Vistas de facturas (compra/venta con múltiples líneas) =====
 PurchaseItemFormSet = inlineformset_factory(
     PurchaseInvoice, Purchase, PurchaseItemForm,
-    extra=1, can_delete=True,
+    formset=InvoiceItemFormSet, extra=1, can_delete=True,
 )
 SaleItemFormSet = inlineformset_factory(
     SaleInvoice, Sale, SaleItemForm,
-    extra=1, can_delete=True,
+    formset=InvoiceItemFormSet, extra=1, can_delete=True,
 )
 
 
@@ -241,9 +416,10 @@ def purchase_invoice_form_view(request, pk=None):
         form = PurchaseInvoiceForm(request.POST, instance=invoice)
         formset = PurchaseItemFormSet(request.POST, instance=invoice)
         if form.is_valid() and formset.is_valid():
-            invoice = form.save()
-            formset.instance = invoice
-            formset.save()
+            with transaction.atomic():
+                invoice = form.save()
+                formset.instance = invoice
+                post_purchase_invoice(formset)
             messages.success(request, "Se ha guardado correctamente.")
             return redirect("purchase_invoice_new")
     else:
@@ -268,9 +444,10 @@ def sale_invoice_form_view(request, pk=None):
         form = SaleInvoiceForm(request.POST, instance=invoice)
         formset = SaleItemFormSet(request.POST, instance=invoice)
         if form.is_valid() and formset.is_valid():
-            invoice = form.save()
-            formset.instance = invoice
-            formset.save()
+            with transaction.atomic():
+                invoice = form.save()
+                formset.instance = invoice
+                post_sale_invoice(formset)
             messages.success(request, "Se ha guardado correctamente.")
             return redirect("sale_invoice_new")
     else:
@@ -293,6 +470,7 @@ def purchase_invoice_detail_view(request, pk):
     context = {
         "title": f"Factura de Compra #{invoice.id}",
         "invoice": invoice,
+        "items": invoice.items.select_related("product"),
         "party_label": "Proveedor",
         "party": invoice.supplier,
         "kind": "purchase",
@@ -309,6 +487,7 @@ def sale_invoice_detail_view(request, pk):
     context = {
         "title": f"Factura de Venta #{invoice.id}",
         "invoice": invoice,
+        "items": invoice.items.select_related("product"),
         "party_label": "Cliente",
         "party": invoice.customer,
         "kind": "sale",
@@ -318,10 +497,11 @@ def sale_invoice_detail_view(request, pk):
     return render(request, "invoice_detail.html", context)
 
 
-@login_required
-def home(request):
-    today = now()
-    today_date = today.date()
+def dashboard_context(today_date, sales_window):
+    """
+    Calcula todas las métricas del dashboard. El resultado solo contiene
+    valores ya evaluados (listas, no querysets) para poder guardarse en caché.
+    """
     yesterday_date = today_date - timedelta(days=1)
     week_date = today_date - timedelta(days=7)
     last_week_date = today_date - timedelta(days=14)
@@ -329,40 +509,36 @@ def home(request):
     prev_month_end = month_start - timedelta(days=1)
     prev_month_start = prev_month_end.replace(day=1)
     last30_date = today_date - timedelta(days=30)
-    last365_date = today_date - timedelta(days=365)
-
-    # ===== INGRESOS POR PERÍODO =====
-    income_today = Sale.objects.filter(
-        invoice__date__gte=today_date
-    ).aggregate(total=Sum(F("quantity") * F("price")))["total"] or 0
-
-    income_yesterday = Sale.objects.filter(
-        invoice__date__gte=yesterday_date, invoice__date__lt=today_date
-    ).aggregate(total=Sum(F("quantity") * F("price")))["total"] or 0
-
-    income_last_7_days = Sale.objects.filter(
-        invoice__date__gte=week_date
-    ).aggregate(total=Sum(F("quantity") * F("price")))["total"] or 0
 
-    income_previous_week = Sale.objects.filter(
-        invoice__date__gte=last_week_date, invoice__date__lt=week_date
-    ).aggregate(total=Sum(F("quantity") * F("price")))["total"] or 0
-
-    income_this_month = Sale.objects.filter(
-        invoice__date__gte=month_start
-    ).aggregate(total=Sum(F("quantity") * F("price")))["total"] or 0
-
-    income_last_month = Sale.objects.filter(
-        invoice__date__gte=prev_month_start, invoice__date__lte=prev_month_end
-    ).aggregate(total=Sum(F("quantity") * F("price")))["total"] or 0
-
-    income_last_30_days = Sale.objects.filter(
-        invoice__date__gte=last30_date
-    ).aggregate(total=Sum(F("quantity") * F("price")))["total"] or 0
+    # Todos los períodos del dashboard: (inicio inclusivo, fin exclusivo)
+    periods = {
+        "today": (today_date, None),
+        "yesterday": (yesterday_date, today_date),
+        "last_7_days": (week_date, None),
+        "previous_week": (last_week_date, week_date),
+        "this_month": (month_start, None),
+        "last_month": (prev_month_start, month_start),
+        "last_30_days": (last30_date, None),
+        "total": (None, None),
+    }
 
-    income_total = Sale.objects.aggregate(
-        total=Sum(F("quantity") * F("price"))
-    )["total"] or 0
+    # ===== INGRESOS, VENTAS Y MÁRGENES (una sola consulta) =====
+    sales = period_totals(
+        DailyProductSales.objects, "date", periods,
+        sums={
+            "income": F("revenue"),
+            "margin": F("revenue") - F("cost"),
+            "count": F("lines"),
+        },
+    )
+    income_today = sales["income"]["today"]
+    income_yesterday = sales["income"]["yesterday"]
+    income_last_7_days = sales["income"]["last_7_days"]
+    income_previous_week = sales["income"]["previous_week"]
+    income_this_month = sales["income"]["this_month"]
+    income_last_month = sales["income"]["last_month"]
+    income_last_30_days = sales["income"]["last_30_days"]
+    income_total = sales["income"]["total"]
 
     # ===== PORCENTAJES DE CRECIMIENTO =====
     def growth_percentage(current, previous):
@@ -375,151 +551,102 @@ def home(request):
     growth_month = growth_percentage(income_this_month, income_last_month)
 
     # ===== COMPRAS Y GASTOS =====
-    purchases_this_month = Purchase.objects.filter(
-        invoice__date__gte=month_start
-    ).aggregate(total=Sum(F("quantity") * F("cost")))["total"] or 0
-
-    purchases_last_month = Purchase.objects.filter(
-        invoice__date__gte=prev_month_start, invoice__date__lte=prev_month_end
-    ).aggregate(total=Sum(F("quantity") * F("cost")))["total"] or 0
-
-    purchases_last_30_days = Purchase.objects.filter(
-        invoice__date__gte=last30_date
-    ).aggregate(total=Sum(F("quantity") * F("cost")))["total"] or 0
-
-    expenses_this_month = Expense.objects.filter(
-        date__gte=month_start
-    ).aggregate(total=Sum("amount"))["total"] or 0
-
-    expenses_last_month = Expense.objects.filter(
-        date__gte=prev_month_start, date__lte=prev_month_end
-    ).aggregate(total=Sum("amount"))["total"] or 0
+    purchases = period_totals(
+        Purchase.objects, "date",
+        {key: periods[key] for key in ("this_month", "last_month", "last_30_days")},
+        sums={"total": F("quantity") * F("cost")},
+    )["total"]
+    purchases_this_month = purchases["this_month"]
+    purchases_last_month = purchases["last_month"]
+    purchases_last_30_days = purchases["last_30_days"]
+
+    expenses = period_totals(
+        Expense.objects, "date",
+        {key: periods[key] for key in ("this_month", "last_month", "last_30_days")},
+        sums={"total": F("amount")},
+    )["total"]
+    expenses_this_month = expenses["this_month"]
+    expenses_last_month = expenses["last_month"]
 
     purchases_growth = growth_percentage(purchases_this_month, purchases_last_month)
     expenses_growth = growth_percentage(expenses_this_month, expenses_last_month)
 
     # ===== OTROS INGRESOS (no provenientes de ventas) =====
-    other_income_this_month = OtherIncome.objects.filter(
-        date__gte=month_start
-    ).aggregate(total=Sum("amount"))["total"] or 0
-
-    other_income_last_month = OtherIncome.objects.filter(
-        date__gte=prev_month_start, date__lte=prev_month_end
-    ).aggregate(total=Sum("amount"))["total"] or 0
-
-    other_income_last_30_days = OtherIncome.objects.filter(
-        date__gte=last30_date
-    ).aggregate(total=Sum("amount"))["total"] or 0
-
-    other_income_total = OtherIncome.objects.aggregate(
-        total=Sum("amount")
-    )["total"] or 0
+    other_income = period_totals(
+        OtherIncome.objects, "date",
+        {key: periods[key]
+         for key in ("this_month", "last_month", "last_30_days", "total")},
+        sums={"total": F("amount")},
+    )["total"]
+    other_income_this_month = other_income["this_month"]
+    other_income_last_month = other_income["last_month"]
+    other_income_last_30_days = other_income["last_30_days"]
+    other_income_total = other_income["total"]
 
     other_income_growth = growth_percentage(
         other_income_this_month, other_income_last_month
     )
 
     # ===== VENTAS (CANTIDAD) POR PERÍODO =====
-    sales_count_today = Sale.objects.filter(invoice__date__gte=today_date).count()
-    sales_count_last_7_days = Sale.objects.filter(invoice__date__gte=week_date).count()
-    sales_count_total = Sale.objects.count()
+    sales_count_today = sales["count"]["today"]
+    sales_count_last_7_days = sales["count"]["last_7_days"]
+    sales_count_total = sales["count"]["total"]
 
     # ===== MÁRGENES Y COSTOS =====
-    margin_last_30_days = Sale.objects.filter(
-        invoice__date__gte=last30_date
-    ).aggregate(m=Sum((F("price") - F("cost")) * F("quantity")))["m"] or 0
-
-    margin_total = Sale.objects.aggregate(
-        m=Sum((F("price") - F("cost")) * F("quantity"))
-    )["m"] or 0
-
-    expenses_last_30_days = Expense.objects.filter(
-        date__gte=last30_date
-    ).aggregate(total=Sum("amount"))["total"] or 0
+    margin_last_30_days = sales["margin"]["last_30_days"]
+    margin_total = sales["margin"]["total"]
+    expenses_last_30_days = expenses["last_30_days"]
 
     # ===== INVENTARIO =====
     inventory_value = Product.objects.annotate(
         value=F("stock") * F("average_cost")
     ).aggregate(total=Sum("value"))["total"] or 0
 
-    low_stock = Product.objects.filter(stock__lt=2).order_by("stock")[:10]
-    out_of_stock = Product.objects.filter(stock=0).order_by("name")[:10]
+    low_stock = list(Product.objects.filter(stock__lt=2).order_by("stock")[:10])
+    out_of_stock = list(Product.objects.filter(stock=0).order_by("name")[:10])
 
     # ===== TOP PRODUCTOS =====
-    top_products_today = (
-        Sale.objects.filter(invoice__date__gte=today_date)
+    top_products_today = list(
+        DailyProductSales.objects.filter(date__gte=today_date)
         .values("product__name")
-        .annotate(total_sold=Sum("quantity"), total_revenue=Sum(F("quantity") * F("price")))
+        .annotate(total_sold=Sum("quantity"), total_revenue=Sum("revenue"))
         .order_by("-total_sold")[:5]
     )
 
-    top_products_week = (
-        Sale.objects.filter(invoice__date__gte=week_date)
+    top_products_week = list(
+        DailyProductSales.objects.filter(date__gte=week_date)
         .values("product__name")
-        .annotate(total_sold=Sum("quantity"), total_revenue=Sum(F("quantity") * F("price")))
+        .annotate(total_sold=Sum("quantity"), total_revenue=Sum("revenue"))
         .order_by("-total_sold")[:5]
     )
 
-    top_products_month = (
-        Sale.objects.filter(invoice__date__gte=last30_date)
+    top_products_month = list(
+        DailyProductSales.objects.filter(date__gte=last30_date)
         .values("product__name")
-        .annotate(total_sold=Sum("quantity"), total_revenue=Sum(F("quantity") * F("price")))
+        .annotate(total_sold=Sum("quantity"), total_revenue=Sum("revenue"))
         .order_by("-total_sold")[:5]
     )
 
     # ===== TOP CATEGORÍAS =====
-    top_categories_month = (
-        Sale.objects.filter(invoice__date__gte=last30_date)
-        .values("product__category__name")
-        .annotate(total_sold=Sum("quantity"), total_revenue=Sum(F("quantity") * F("price")))
+    top_categories_month = list(
+        DailyProductSales.objects.filter(date__gte=last30_date)
+        .values("category__name")
+        .annotate(total_sold=Sum("quantity"), total_revenue=Sum("revenue"))
         .order_by("-total_sold")[:5]
     )
 
     # ===== PROYECCIÓN DE INVENTARIO =====
-    products_with_stock = Product.objects.filter(stock__gt=0)
-    projection_rows = []
-
-    for p in products_with_stock:
-        sold_365 = Sale.objects.filter(
-            product=p, invoice__date__gte=last365_date
-        ).aggregate(total=Sum("quantity"))["total"] or 0
-
-        if sold_365 > 0:
-            days_per_unit = 365 / sold_365
-            days_to_runout = p.stock * days_per_unit
-        else:
-            days_per_unit = None
-            days_to_runout = None
-
-        projection_rows.append({
-            "product": p,
-            "sold_365": sold_365,
-            "days_per_unit": days_per_unit,
-            "days_to_runout": days_to_runout,
-        })
-
-    business_projection = sorted(
-        [row for row in projection_rows if row["days_to_runout"] is not None],
-        key=lambda r: r["days_to_runout"]
-    )[:5]
+    business_projection = runout_ranking(today_date, limit=5)
 
     # ===== DATOS PARA GRÁFICOS =====
-    daily_sales_labels = []
-    daily_sales_values = []
-    for i in range(7):
-        day_start = today_date - timedelta(days=i)
-        day_end = day_start + timedelta(days=1)
-        day_income = Sale.objects.filter(
-            invoice__date__gte=day_start, invoice__date__lt=day_end
-        ).aggregate(total=Sum(F("quantity") * F("price")))["total"] or 0
-        day_income_float = float(day_income)
-        daily_sales_labels.insert(0, day_start.strftime("%a %d"))
-        daily_sales_values.insert(0, day_income_float)
+    daily_sales_labels, daily_sales_values = sales_series(
+        today_date, sales_window, SALES_WINDOWS[sales_window]
+    )
 
     category_labels = []
     category_values = []
     for cat in top_categories_month:
-        category_name = cat["product__category__name"] or "Sin categoría"
+        category_name = cat["category__name"] or "Sin categoría"
         category_labels.append(category_name)
         category_values.append(float(cat["total_revenue"]))
 
@@ -578,12 +705,30 @@ def home(request):
 
         "business_projection": business_projection,
 
+        "sales_window": sales_window,
+        "sales_windows": list(SALES_WINDOWS),
         "daily_sales_labels_json": daily_sales_labels_json,
         "daily_sales_values_json": daily_sales_values_json,
         "category_labels_json": category_labels_json,
         "category_values_json": category_values_json,
     }
+    return context
 
+
+@login_required
+def home(request):
+    today_date = now().date()
+    try:
+        sales_window = int(request.GET.get("window", 7))
+    except ValueError:
+        sales_window = 7
+    if sales_window not in SALES_WINDOWS:
+        sales_window = 7
+
+    context = cached_dashboard(
+        today_date, sales_window,
+        lambda: dashboard_context(today_date, sales_window),
+    )
     return render(request, "home.html", context)
 
 
@@ -612,19 +757,15 @@ def month_result(request, month_offset=0):
 
     start, end = month_range_from_offset(month_offset)
 
-    sale_filter = {"invoice__date__range": [start, end]}
+    sale_filter = {"date__range": [start, end]}
     expense_filter = {"date__range": [start, end]}
 
-    # Ingresos y costos del mes
-    income = (
-        Sale.objects.filter(**sale_filter)
-        .aggregate(total=Sum(F("quantity") * F("price")))
-    )["total"] or 0
-
-    costs = (
-        Sale.objects.filter(**sale_filter)
-        .aggregate(total=Sum(F("quantity") * F("cost")))
-    )["total"] or 0
+    # Ingresos y costos del mes (desde el resumen diario)
+    sales = DailyProductSales.objects.filter(**sale_filter).aggregate(
+        income=Sum("revenue"), costs=Sum("cost"),
+    )
+    income = sales["income"] or 0
+    costs = sales["costs"] or 0
 
     expenses = (
         Expense.objects.filter(**expense_filter)
@@ -639,14 +780,15 @@ def month_result(request, month_offset=0):
     gross_profit = income - costs
     net_profit = income + other_income - costs - expenses
 
+    # Inventario al inicio y al cierre del mes (desde el libro de movimientos)
+    inventory_opening = inventory_value(start - timedelta(days=1))
+    inventory_closing = inventory_value(end)
+
     # Desglose por categoría de producto
     income_by_category = list(
-        Sale.objects.filter(**sale_filter)
-        .values("product__category__name")
-        .annotate(
-            income=Sum(F("quantity") * F("price")),
-            cost=Sum(F("quantity") * F("cost")),
-        )
+        DailyProductSales.objects.filter(**sale_filter)
+        .values("category__name")
+        .annotate(income=Sum("revenue"), cost=Sum("cost"))
         .order_by("-income")
     )
     for row in income_by_category:
@@ -654,7 +796,8 @@ def month_result(request, month_offset=0):
 
     # Gastos del mes: lista detallada y agrupada por categoría
     expenses_list = list(
-        Expense.objects.filter(**expense_filter).order_by("-date", "-id")
+        Expense.objects.filter(**expense_filter).select_related("category")
+        .order_by("-date", "-id")
     )
 
     expenses_by_category = (
@@ -666,7 +809,8 @@ def month_result(request, month_offset=0):
 
     # Otros ingresos del mes: lista detallada y agrupada por categoría
     other_income_list = list(
-        OtherIncome.objects.filter(**expense_filter).order_by("-date", "-id")
+        OtherIncome.objects.filter(**expense_filter).select_related("category")
+        .order_by("-date", "-id")
     )
 
     other_income_by_category = (
@@ -700,6 +844,8 @@ def month_result(request, month_offset=0):
 
         "gross_profit": gross_profit,
         "net_profit": net_profit,
+        "inventory_opening": inventory_opening,
+        "inventory_closing": inventory_closing,
 
         "income_by_category": income_by_category,
         "expenses_list": expenses_list,
@@ -724,67 +870,92 @@ def user_profile(request):
 
 @login_required
 def export_data(request):
+    """
+    Descarga el respaldo como JSON generado por partes.
+    Con ?gzip=1 se comprime al vuelo. Con ?since=<checkpoint ISO> genera
+    un respaldo incremental con los cambios posteriores al checkpoint.
+    """
     from datetime import datetime
 
-    models_to_export = [
-        "Category", "ExpenseCategory", "Product", "ProductImage",
-        "PurchaseInvoice", "Purchase", "SaleInvoice", "Sale", "Expense",
-        "OtherIncomeCategory", "OtherIncome",
-    ]
-    data = {
-        "metadata": {
-            "export_date": datetime.now().isoformat(),
-            "version": "1.1",
-            "model_count": len(models_to_export),
-        },
-        "data": {}
-    }
+    since = None
+    if request.GET.get("since"):
+        try:
+            since = parse_checkpoint(request.GET["since"])
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect("home")
 
-    for model_name in models_to_export:
-        model = apps.get_model("stock", model_name)
-        queryset = model.objects.all()
-        serialized_json = serializers.serialize("json", queryset)
-        serialized_data = json.loads(serialized_json)
-        data["data"][model_name] = serialized_data
-
-    response = HttpResponse(json.dumps(data, indent=2, ensure_ascii=False),
-                            content_type="application/json")
-    response["Content-Disposition"] = 'attachment; filename="mi-stock-backup-{}.json"'.format(
+    stream = buffered(iter_backup_json(since=since))
+    filename = "mi-stock-{}-{}.json".format(
+        "delta" if since else "backup",
         datetime.now().strftime("%Y%m%d-%H%M%S"))
+    content_type = "application/json"
+    if request.GET.get("gzip") == "1":
+        stream = gzipped(stream)
+        filename += ".gz"
+        content_type = "application/gzip"
+
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
     return response
 
 
 @login_required
 def import_data(request):
-    if request.method == "POST" and request.FILES.get("backup_file"):
-        uploaded_file = request.FILES["backup_file"]
+    """
+    Restaura uno o varios respaldos: un completo seguido de incrementales,
+    que se aplican en orden de checkpoint dentro de una sola transacción.
+    """
+    if request.method == "POST" and request.FILES.getlist("backup_file"):
+        uploaded_files = request.FILES.getlist("backup_file")
+        counts = {}
+        deleted = {}
+        elapsed = 0
         try:
-            content = uploaded_file.read().decode("utf-8")
-            data = json.loads(content)
-        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            metadatas = [read_backup_metadata(f) for f in uploaded_files]
+            order = backup_sequence(metadatas)
+            full = any(m.get("type", "full") == "full" for m in metadatas)
+            affected = {"Purchase": set(), "Sale": set(), "Product": set()}
+            with transaction.atomic():
+                for index in order:
+                    file_counts, file_deleted, _, seconds, file_affected = (
+                        import_backup(open_backup(uploaded_files[index])))
+                    for model_name, n in file_counts.items():
+                        counts[model_name] = counts.get(model_name, 0) + n
+                    for model_name, n in file_deleted.items():
+                        deleted[model_name] = deleted.get(model_name, 0) + n
+                    for model_name, keys in file_affected.items():
+                        affected[model_name] |= keys
+                    elapsed += seconds
+                # Las líneas restauradas no pasan por Sale.save/Purchase.save:
+                # recalcular el resumen diario y el libro de movimientos.
+                # Con solo incrementales basta con lo que tocaron.
+                if full:
+                    rebuild_daily_sales()
+                    rebuild_ledger()
+                    take_monthly_snapshots(now().date())
+                else:
+                    refresh_daily_sales(affected["Sale"], affected["Product"])
+                    refresh_line_movements(
+                        affected["Purchase"] | affected["Sale"], affected["Product"])
+        except (UnicodeDecodeError, json.JSONDecodeError, OSError) as e:
             messages.error(request, f"Error al leer el archivo: {e}")
             return redirect("home")
-
-        # Importar en orden para respetar dependencias
-        models_order = [
-            "Category", "ExpenseCategory", "Product", "ProductImage",
-            "PurchaseInvoice", "Purchase", "SaleInvoice", "Sale", "Expense",
-            "OtherIncomeCategory", "OtherIncome",
-        ]
-        imported_counts = {}
-
-        for model_name in models_order:
-            if model_name not in data.get("data", {}):
-                continue
-            serialized_list = data["data"][model_name]
-            json_str = json.dumps(serialized_list)
-            imported = 0
-            for obj in serializers.deserialize("json", json_str):
-                obj.save()
-                imported += 1
-            imported_counts[model_name] = imported
-
-        messages.success(request, f"Datos importados exitosamente: {imported_counts}")
+        except (DeserializationError, IntegrityError, ValueError) as e:
+            messages.error(request, f"Error al restaurar los datos: {e}")
+            return redirect("home")
+        bump_data_version()
+
+        total = sum(counts.values())
+        rate = total / elapsed if elapsed > 0 else total
+        summary = f"Datos importados exitosamente: {counts}"
+        if deleted:
+            summary += f", eliminados: {deleted}"
+        messages.success(
+            request,
+            f"{summary} ({len(uploaded_files)} archivo(s), {total} filas "
+            f"en {elapsed:.1f} s, {rate:,.0f} filas/s)"
+        )
         return redirect("home")
 
     return render(request, "import_form.html")
@@ -801,13 +972,13 @@ def top_products_view(request, period='mes'):
     last30 = today - timedelta(days=30)
 
     if period == 'hoy':
-        date_filter = {'invoice__date__gte': today}
+        date_filter = {'date__gte': today}
         title = "Productos Más Vendidos - Hoy"
     elif period == 'semana':
-        date_filter = {'invoice__date__gte': week_date}
+        date_filter = {'date__gte': week_date}
         title = "Productos Más Vendidos - Última Semana"
     elif period == 'mes':
-        date_filter = {'invoice__date__gte': last30}
+        date_filter = {'date__gte': last30}
         title = "Productos Más Vendidos - Último Mes"
     elif period == 'total':
         date_filter = {}
@@ -816,11 +987,11 @@ def top_products_view(request, period='mes'):
         raise Http404("Período no válido")
 
     top_products = (
-        Sale.objects.filter(**date_filter)
-        .values('product__name', 'product__category__name')
+        DailyProductSales.objects.filter(**date_filter)
+        .values('product__name', 'category__name')
         .annotate(
             total_sold=Sum('quantity'),
-            total_revenue=Sum(F('quantity') * F('price'))
+            total_revenue=Sum('revenue')
         )
         .order_by('-total_sold')
     )
@@ -845,7 +1016,7 @@ def top_products_view(request, period='mes'):
         product = TopProduct(
             pk=idx,
             product_name=item['product__name'],
-            category_name=item['product__category__name'],
+            category_name=item['category__name'],
             total_sold=item['total_sold'],
             total_revenue=item['total_revenue'],
             percentage=percentage
@@ -866,4 +1037,136 @@ def top_products_view(request, period='mes'):
         'show_actions': False,
     }
 
-    return render(request, 'list.html', context)
\ No newline at end of file
+    return render(request, 'list.html', context)
+
+
+@login_required
+def runout_report_view(request):
+    """
+    Reporte paginado de productos ordenados por días hasta agotarse,
+    según las ventas de los últimos 365 días.
+    """
+    per_page = 25
+    try:
+        page = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+
+    rows, total = runout_page(now().date(), page, per_page)
+    num_pages = max((total + per_page - 1) // per_page, 1)
+    if page > num_pages:
+        return redirect(f"{reverse('runout_report')}?page={num_pages}")
+
+    context = {
+        "title": "Proyección de Inventario",
+        "rows": rows,
+        "page": page,
+        "num_pages": num_pages,
+        "total": total,
+        "start_index": (page - 1) * per_page + 1 if rows else 0,
+        "end_index": (page - 1) * per_page + len(rows),
+    }
+    return render(request, "runout.html", context)
+
+
+def valuation_date(request):
+    """Fecha de corte de `?date=AAAA-MM-DD`; hoy si falta o no es válida."""
+    try:
+        return date.fromisoformat(request.GET.get("date", ""))
+    except ValueError:
+        return now().date()
+
+
+@login_required
+def valuation_report_view(request):
+    """
+    Valor del inventario a una fecha pasada, por producto y por categoría,
+    con la serie de cierres de los últimos 24 meses.
+    """
+    day = valuation_date(request)
+    rows, categories, total = valuation_as_of(day)
+    series = month_end_series(now().date())
+    context = {
+        "title": "Valor del Inventario",
+        "day": day,
+        "rows": rows,
+        "categories": categories,
+        "total": total,
+        "series_labels_json": json.dumps([end.strftime("%b %Y") for end, _, _ in series]),
+        "series_values_json": json.dumps([float(value) for _, _, value in series]),
+    }
+    return render(request, "valuation.html", context)
+
+
+@login_required
+def valuation_data_view(request):
+    """Versión JSON del reporte de valor del inventario (`?date=AAAA-MM-DD`)."""
+    day = valuation_date(request)
+    rows, categories, total = valuation_as_of(day)
+    return JsonResponse({
+        "date": day,
+        "total": total,
+        "categories": categories,
+        "products": [
+            {
+                "id": row["product"].pk,
+                "name": row["product"].name,
+                "category": row["product"].category.name,
+                "stock": row["stock"],
+                "value": row["value"],
+                "average_cost": row["average_cost"],
+            }
+            for row in rows
+        ],
+        "month_ends": [
+            {"date": end, "stock": stock, "value": value}
+            for end, stock, value in month_end_series(now().date())
+        ],
+    })
+
+
+@staff_member_required
+def profiles_view(request):
+    """Capturas de cProfile recientes con sus funciones más costosas."""
+    captures = [capture_summary(settings.PROFILE_DIR, name)
+                for name in list_captures(settings.PROFILE_DIR)[:20]]
+    return render(request, "profiles.html", {
+        "title": "Perfiles de peticiones",
+        "captures": captures,
+    })
+
+
+@staff_member_required
+def profile_file_view(request, filename):
+    """Descarga un archivo de una captura (.prof, pilas colapsadas o .json)."""
+    name = next((filename[:-len(suffix)] for suffix in CAPTURE_FILES
+                 if filename.endswith(suffix)), None)
+    if name not in list_captures(settings.PROFILE_DIR):
+        raise Http404("Captura no encontrada")
+    return FileResponse(open(os.path.join(settings.PROFILE_DIR, filename), "rb"),
+                        as_attachment=True, filename=filename)
+
+
+def metrics_view(request):
+    """
+    Métricas en formato de texto de Prometheus. Solo responde con
+    METRICS = True y a peticiones hechas desde la misma máquina
+    (METRICS_ALLOWED_IPS) que no pasaron por un proxy.
+    """
+    if not settings.METRICS:
+        raise Http404("Métricas desactivadas")
+    if (request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS
+            or "HTTP_X_FORWARDED_FOR" in request.META):
+        return HttpResponseForbidden("Solo disponible desde la misma máquina")
+
+    today_date = now().date()
+    gauges = []
+    # Con la caché en memoria de cada proceso, la antigüedad sería solo la
+    # del proceso que responde: se omite (ver DJANGO_CACHE_DIR)
+    for window in SALES_WINDOWS if cache_is_shared() else ():
+        age = dashboard_age(today_date, window)
+        if age is not None:
+            gauges.append(("mistock_dashboard_cache_age_seconds",
+                           {"window": window}, age))
+    return HttpResponse(render_metrics(gauges),
+                        content_type="text/plain; version=0.0.4; charset=utf-8")